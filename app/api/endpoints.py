@@ -69,10 +69,10 @@ async def health_check():
         }
 
 @router.get("/health/detailed", summary="Health check détaillé")
-async def detailed_health_check():
-    """Vérification détaillée de l'état de santé de tous les composants"""
+async def detailed_health_check(force: bool = False):
+    """Vérification détaillée de l'état de santé de tous les composants (force=true ignore le cache)"""
     try:
-        system_health = await health_checker.perform_full_health_check()
+        system_health = await health_checker.perform_full_health_check(force=force)
         
         return {
             "overall_status": system_health.overall_status.value,
@@ -497,58 +497,34 @@ async def ask_question_stream_ultra(request: QuestionRequest):
                     )
                     return
 
-            # Enhancement et recherche (si pas de réponse prédéfinie)
-            llm_provider = OptimizedLLMProvider(request.provider)
-            enhanced_queries = await multimodal_rag_system.query_enhancer.enhance_query(request.question, llm_provider)
-
-            # Métadonnées initiales
-            initial_metadata = {
-                "id": query_id,
-                "provider": request.provider.value,
-                "enhanced_queries": enhanced_queries,
-                "timestamp": datetime.now().isoformat()
-            }
-            yield f"data: {json.dumps({'metadata': initial_metadata, 'type': 'init'})}\n\n"
-
-            # Recherche hybride
-            all_results = []
-            for query_variant in enhanced_queries:
-                results = await multimodal_rag_system.hybrid_search.search(query_variant, n_results=15)
-                all_results.extend(results)
-
-            if not all_results:
-                yield f"data: {json.dumps({'content': 'Aucun document pertinent trouvé.', 'type': 'final'})}\n\n"
-                return
-
-            # Re-ranking
-            ranked_results = multimodal_rag_system.reranker.rerank(request.question, all_results, top_k=request.top_k)
-
-            # Préparation contexte
-            context_parts = [f"Source {i + 1}: {result.content}" for i, result in enumerate(ranked_results)]
-            context = "\n\n".join(context_parts)
-
-            # Prompt optimisé
-            optimized_prompt = f"""Contexte: {context}
-
-Question: {request.question}
-
-Répondez en utilisant uniquement le contexte fourni. Citez les sources quand approprié.
-
-Réponse:"""
-
-            # Streaming de la génération
-            provider = OptimizedLLMProvider(request.provider)
-            
-            # Collecte des chunks pour le CSV
-            async for chunk in provider.generate_stream(optimized_prompt):
-                if chunk:
-                    response_chunks.append(chunk)
-                    final_response += chunk
-                    yield f"data: {json.dumps({'content': chunk, 'type': 'chunk'})}\n\n"
-            
-            # Données pour CSV
-            sources = [result.content[:100] + "..." for result in ranked_results]
-            cache_hit = False  # RAG normal n'utilise pas le cache
+            # Pipeline RAG partagé avec /ask-question-ultra : les tokens du LLM sont relayés
+            # dès leur génération, la réponse complète est mise en cache à la fin du flux
+            response = None
+            async for event in multimodal_rag_system.query_stream(
+                request.question, request.provider, top_k=request.top_k
+            ):
+                event_type = event["type"]
+                if event_type == "chunk":
+                    chunk = event["content"]
+                    if chunk:
+                        response_chunks.append(chunk)
+                        final_response += chunk
+                        yield f"data: {json.dumps({'content': chunk, 'type': 'chunk'})}\n\n"
+                elif event_type == "init":
+                    query_id = event["id"]
+                    initial_metadata = {
+                        "id": query_id,
+                        "provider": request.provider.value,
+                        "enhanced_queries": event["enhanced_queries"],
+                        "timestamp": datetime.now().isoformat()
+                    }
+                    yield f"data: {json.dumps({'metadata': initial_metadata, 'type': 'init'})}\n\n"
+                elif event_type == "error":
+                    raise RuntimeError(event["error"])
+                else:
+                    response = event["response"]
+                    sources = event["source_previews"]
+                    cache_hit = event["cache_hit"]
 
             # Métadonnées finales
             end_time = time.time()
@@ -556,8 +532,8 @@ Réponse:"""
             stream_duration = processing_time
             final_metadata = {
                 "response_time_ms": processing_time,
-                "search_results": len(all_results),
-                "ranked_results": len(ranked_results)
+                "search_results": response["search_results"] if response else 0,
+                "ranked_results": response["ranked_results"] if response else 0
             }
             yield f"data: {json.dumps({'metadata': final_metadata, 'type': 'final'})}\n\n"
             
@@ -941,13 +917,15 @@ async def delete_document_advanced(document_id: str):
     """Suppression avancée avec nettoyage complet"""
     try:
         # Suppression de ChromaDB
-        multimodal_rag_system.collection.delete(where={"document_id": document_id})
+        collection = multimodal_rag_system.collection
+        removed_ids = (await asyncio.to_thread(
+            collection.get, where={"document_id": document_id}, include=[]
+        ))["ids"]
+        if removed_ids:
+            await asyncio.to_thread(collection.delete, ids=removed_ids)
 
-        # Reconstruction index BM25
-        await asyncio.get_event_loop().run_in_executor(
-            multimodal_rag_system.executor,
-            multimodal_rag_system.hybrid_search.rebuild_index
-        )
+        # Mise à jour de l'index BM25 (retrait des chunks supprimés uniquement)
+        await asyncio.to_thread(multimodal_rag_system.hybrid_search.add_to_index, [], removed_ids)
 
         return {
             "message": f"Document '{document_id}' supprimé avec succès",
@@ -968,7 +946,7 @@ async def get_multimodal_capabilities():
 
     try:
         # S'assurer que les composants multimodaux sont initialisés
-        multimodal_rag_system._ensure_multimodal_components()
+        await multimodal_rag_system._ensure_multimodal_components()
         
         # Test des modèles
         models_status = {}
@@ -1034,7 +1012,7 @@ async def analyze_image(file: UploadFile = File(...)):
         image_content = await file.read()
 
         # Traitement de l'image
-        image_data = multimodal_rag_system.multimodal_processor.process_image_document(
+        image_data = await multimodal_rag_system.multimodal_processor.process_image_document(
             image_content,
             file.filename
         )
@@ -1042,14 +1020,14 @@ async def analyze_image(file: UploadFile = File(...)):
         return {
             "filename": file.filename,
             "analysis": {
-                "caption": image_data["caption"],
-                "ocr_text": image_data["ocr_text"],
-                "has_text": len(image_data["ocr_text"].strip()) > 10,
-                "image_size": image_data["metadata"]["image_size"],
-                "image_mode": image_data["metadata"]["image_mode"]
+                "caption": image_data.caption,
+                "ocr_text": image_data.ocr_text,
+                "has_text": len(image_data.ocr_text.strip()) > 10,
+                "image_size": image_data.metadata["image_size"],
+                "image_mode": image_data.metadata["image_mode"]
             },
-            "searchable_content": image_data["content"],
-            "metadata": image_data["metadata"]
+            "searchable_content": image_data.content,
+            "metadata": image_data.metadata
         }
 
     except Exception as e:
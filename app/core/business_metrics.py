@@ -81,13 +81,13 @@ class BusinessMetricsCollector:
             
             if matched:
                 self.predefined_qa_stats["successful_matches"] += 1
-                metrics_collector.increment_counter("predefined_qa_matches_total", {
+                metrics_collector.increment_counter("predefined_qa_matches_total", labels={
                     "category": category or "unknown",
                     "status": "success"
                 })
             else:
                 self.predefined_qa_stats["failed_matches"] += 1
-                metrics_collector.increment_counter("predefined_qa_matches_total", {
+                metrics_collector.increment_counter("predefined_qa_matches_total", labels={
                     "category": category or "unknown",
                     "status": "failed"
                 })
@@ -138,13 +138,13 @@ class BusinessMetricsCollector:
             
             if success:
                 self.rag_stats["successful_retrievals"] += 1
-                metrics_collector.increment_counter("rag_queries_total", {
+                metrics_collector.increment_counter("rag_queries_total", labels={
                     "status": "success",
                     "num_docs": str(min(num_documents_retrieved, 10))  # Grouper par tranches
                 })
             else:
                 self.rag_stats["failed_retrievals"] += 1
-                metrics_collector.increment_counter("rag_queries_total", {
+                metrics_collector.increment_counter("rag_queries_total", labels={
                     "status": "failed",
                     "num_docs": "0"
                 })
@@ -185,7 +185,7 @@ class BusinessMetricsCollector:
                         self.rag_stats["document_hits"][doc_id] = 0
                     self.rag_stats["document_hits"][doc_id] += 1
                     
-                    metrics_collector.increment_counter("rag_document_usage_total", {
+                    metrics_collector.increment_counter("rag_document_usage_total", labels={
                         "document_id": doc_id[:50]  # Limiter la longueur pour éviter la cardinalité élevée
                     })
             
@@ -205,7 +205,7 @@ class BusinessMetricsCollector:
             
             if operation == "hit":
                 self.cache_stats["cache_hits"] += 1
-                metrics_collector.increment_counter("cache_operations_total", {
+                metrics_collector.increment_counter("cache_operations_total", labels={
                     "operation": "hit",
                     "endpoint": endpoint
                 })
@@ -218,21 +218,21 @@ class BusinessMetricsCollector:
                 
             elif operation == "miss":
                 self.cache_stats["cache_misses"] += 1
-                metrics_collector.increment_counter("cache_operations_total", {
+                metrics_collector.increment_counter("cache_operations_total", labels={
                     "operation": "miss",
                     "endpoint": endpoint
                 })
                 
             elif operation == "write":
                 self.cache_stats["cache_writes"] += 1
-                metrics_collector.increment_counter("cache_operations_total", {
+                metrics_collector.increment_counter("cache_operations_total", labels={
                     "operation": "write",
                     "endpoint": endpoint
                 })
                 
             elif operation == "invalidate":
                 self.cache_stats["cache_invalidations"] += 1
-                metrics_collector.increment_counter("cache_operations_total", {
+                metrics_collector.increment_counter("cache_operations_total", labels={
                     "operation": "invalidate",
                     "endpoint": endpoint
                 })
@@ -270,7 +270,7 @@ class BusinessMetricsCollector:
             self.user_interaction_stats["unique_sessions"].add(session_id)
             self.user_interaction_stats["total_interactions"] += 1
             
-            metrics_collector.increment_counter("user_interactions_total", {
+            metrics_collector.increment_counter("user_interactions_total", labels={
                 "type": interaction_type,
                 "session_id": session_id[:8]  # Anonymiser partiellement
             })
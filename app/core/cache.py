@@ -1,7 +1,10 @@
+import copy
 import redis
 import hashlib
 import pickle
 import threading
+import time
+from collections import OrderedDict
 from typing import Optional, Any
 from functools import lru_cache
 import os
@@ -9,6 +12,37 @@ import os
 from app.core.config import settings
 from app.utils.logging import logger
 
+# orjson optionnel : sérialisation JSON native des réponses, repli sur pickle
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Types de cache dont les valeurs sont des dictionnaires JSON (sérialisés en orjson dans Redis) ;
+# les autres (embeddings, RankedResult...) restent en pickle pour conserver leurs types
+_JSON_CACHE_TYPES = frozenset({"full_response", "query_enhancement"})
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY if ORJSON_AVAILABLE else 0
+
+
+def _serialize(value: Any, cache_type: str) -> str:
+    if ORJSON_AVAILABLE and cache_type in _JSON_CACHE_TYPES:
+        return orjson.dumps(value, option=_ORJSON_OPTIONS).decode()
+    return pickle.dumps(value).decode('latin1')
+
+
+def _detach(value: Any, cache_type: str) -> Any:
+    """Copie superficielle des réponses JSON : un appelant qui ajoute une clé ne modifie pas l'entrée en cache"""
+    if cache_type in _JSON_CACHE_TYPES:
+        return copy.copy(value)
+    return value
+
+
+def _deserialize(raw: str, cache_type: str) -> Any:
+    if ORJSON_AVAILABLE and cache_type in _JSON_CACHE_TYPES:
+        return orjson.loads(raw)
+    return pickle.loads(raw.encode('latin1'))
+
 # Configuration Redis
 try:
     redis_client = redis.Redis(
@@ -32,7 +66,8 @@ except Exception as e:
 # Système de cache multi-niveaux
 class MultiLayerCache:
     def __init__(self):
-        self.memory_cache = {}
+        # LRU borné : clé -> (expiration monotone, valeur)
+        self.memory_cache: OrderedDict = OrderedDict()
         self.memory_cache_lock = threading.Lock()
         self.max_memory_items = 1000
 
@@ -42,22 +77,27 @@ class MultiLayerCache:
     def get(self, key: str, cache_type: str = "general") -> Optional[Any]:
         cache_key = self._get_cache_key(key, cache_type)
 
-        # Essayer Redis d'abord
+        # Cache mémoire d'abord : aucune désérialisation (copie superficielle des réponses JSON)
+        with self.memory_cache_lock:
+            entry = self.memory_cache.get(cache_key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at >= time.monotonic():
+                    self.memory_cache.move_to_end(cache_key)
+                    logger.info(f"Cache hit mémoire: {cache_key}")
+                    return _detach(value, cache_type)
+                del self.memory_cache[cache_key]
+
+        # Puis Redis (partagé entre workers)
         if REDIS_AVAILABLE:
             try:
                 result = redis_client.get(cache_key)
                 if result:
                     logger.info(f"Cache hit Redis: {cache_key}")
-                    return pickle.loads(result.encode('latin1'))
+                    return _deserialize(result, cache_type)
             except Exception as e:
                 logger.error(f"Erreur Redis get: {e}")
 
-        # Fallback sur cache mémoire
-        with self.memory_cache_lock:
-            if cache_key in self.memory_cache:
-                logger.info(f"Cache hit mémoire: {cache_key}")
-                return self.memory_cache[cache_key]
-
         return None
 
     def set(self, key: str, value: Any, ttl: int = 3600, cache_type: str = "general"):
@@ -66,20 +106,18 @@ class MultiLayerCache:
         # Redis
         if REDIS_AVAILABLE:
             try:
-                serialized = pickle.dumps(value).decode('latin1')
+                serialized = _serialize(value, cache_type)
                 redis_client.setex(cache_key, ttl, serialized)
             except Exception as e:
                 logger.error(f"Erreur Redis set: {e}")
 
         # Cache mémoire
         with self.memory_cache_lock:
-            if len(self.memory_cache) >= self.max_memory_items:
-                # Supprimer les entrées les plus anciennes
-                oldest_keys = list(self.memory_cache.keys())[:100]
-                for old_key in oldest_keys:
-                    del self.memory_cache[old_key]
-
-            self.memory_cache[cache_key] = value
+            self.memory_cache[cache_key] = (time.monotonic() + ttl, _detach(value, cache_type))
+            self.memory_cache.move_to_end(cache_key)
+            # Éviction des entrées les moins récemment utilisées
+            while len(self.memory_cache) > self.max_memory_items:
+                self.memory_cache.popitem(last=False)
 
 
 # Cache global
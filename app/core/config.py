@@ -33,6 +33,9 @@ class Settings(BaseSettings):
         "text_embedding": "sentence-transformers/clip-ViT-B-32-multilingual-v1"
     }
 
+    # Cross-encoder ONNX quantifié int8 (généré par scripts/export_reranker_onnx.py)
+    RERANKER_ONNX_PATH: str = os.getenv("RERANKER_ONNX_PATH", "./models/reranker-onnx-int8")
+
     # Optimisation LLM
     ENABLE_PREDEFINED_QA: bool = os.getenv("ENABLE_PREDEFINED_QA", "true").lower() == "true"
 
@@ -1,15 +1,24 @@
+import threading
+from collections import OrderedDict
+
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from typing import List
-from functools import lru_cache
 
 from app.core.cache import cache
 from app.utils.logging import logger
 
+# Nombre d'embeddings de requêtes conservés en mémoire (clé : texte exact encodé)
+QUERY_CACHE_SIZE = 4096
+
 
 # Modèles d'embeddings avancés
 class AdvancedEmbeddings:
     def __init__(self):
+        # Cache LRU des embeddings de requêtes, partagé par embed_query et embed_queries_batch
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+
         try:
             # Modèle principal optimisé
             self.primary_model = SentenceTransformer(
@@ -43,10 +52,37 @@ class AdvancedEmbeddings:
                 logger.error(f"Erreur chargement modèle multilingue: {e}")
                 self.multilingual_model = None
 
-    @lru_cache(maxsize=5000)
+    def _cached_query(self, key: str):
+        with self._query_cache_lock:
+            embedding = self._query_cache.get(key)
+            if embedding is not None:
+                self._query_cache.move_to_end(key)
+            return embedding
+
+    def _store_query(self, key: str, embedding: np.ndarray):
+        with self._query_cache_lock:
+            self._query_cache[key] = embedding
+            self._query_cache.move_to_end(key)
+            if len(self._query_cache) > QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+
     def embed_query(self, text: str) -> np.ndarray:
-        """Cache des embeddings de requêtes avec LRU"""
-        return self.primary_model.encode([text])[0]
+        """Cache des embeddings de requêtes avec LRU (texte encodé tel quel)"""
+        embedding = self._cached_query(text)
+        if embedding is None:
+            embedding = self.primary_model.encode([text])[0]
+            self._store_query(text, embedding)
+        return embedding
+
+    def embed_queries_batch(self, texts: List[str]) -> np.ndarray:
+        """Embeddings de plusieurs requêtes en une seule passe du modèle (requêtes déjà vues servies par le cache)"""
+        found = {text: self._cached_query(text) for text in dict.fromkeys(texts)}
+        missing = [key for key, embedding in found.items() if embedding is None]
+        if missing:
+            for key, embedding in zip(missing, self.primary_model.encode(missing)):
+                found[key] = embedding
+                self._store_query(key, embedding)
+        return np.asarray([found[text] for text in texts])
 
     def embed_documents(self, texts: List[str], use_cache: bool = True) -> List[np.ndarray]:
         """Embedding de documents avec cache intelligent"""
@@ -9,7 +9,7 @@ import redis
 import psutil
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any, Tuple
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from enum import Enum
 import httpx
 import os
@@ -50,6 +50,9 @@ class HealthChecker:
         self.redis_client = None
         self.last_check_cache = {}
         self.check_interval = 30  # secondes
+        # Client HTTP partagé (créé au premier check) : connexions keep-alive réutilisées
+        # d'un check à l'autre, nouvelle tentative sur échec de connexion
+        self._http_client: Optional[httpx.AsyncClient] = None
         
         # Initialisation des clients
         self._init_redis_client()
@@ -72,6 +75,22 @@ class HealthChecker:
         except Exception as e:
             print(f"Erreur lors de l'initialisation du client Redis: {e}")
     
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Retourne le client HTTP partagé des checks d'endpoints"""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(
+                timeout=10.0,
+                limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+                transport=httpx.AsyncHTTPTransport(retries=3)
+            )
+        return self._http_client
+    
+    async def close(self):
+        """Ferme le client HTTP partagé"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+    
     async def check_system_resources(self) -> ComponentHealth:
         """Vérifie les ressources système"""
         start_time = time.time()
@@ -322,20 +341,17 @@ class HealthChecker:
             # Test des endpoints internes
             base_url = "http://localhost:8000"
             
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                # Test de l'endpoint de base
-                try:
-                    response = await client.get(f"{base_url}/")
-                    root_status = response.status_code == 200
-                except:
-                    root_status = False
-                
-                # Test de l'endpoint de santé (s'il existe)
+            client = self._get_http_client()
+            
+            async def probe(path: str) -> bool:
                 try:
-                    response = await client.get(f"{base_url}/health")
-                    health_status = response.status_code == 200
+                    response = await client.get(f"{base_url}{path}")
+                    return response.status_code == 200
                 except:
-                    health_status = False
+                    return False
+            
+            # Endpoint de base et endpoint de santé testés en parallèle (I/O pures)
+            root_status, health_status = await asyncio.gather(probe("/"), probe("/health"))
             
             if root_status:
                 status = HealthStatus.HEALTHY
@@ -366,8 +382,15 @@ class HealthChecker:
             details=details
         )
     
-    async def perform_full_health_check(self) -> SystemHealth:
-        """Effectue un check complet de tous les composants"""
+    async def perform_full_health_check(self, force: bool = False) -> SystemHealth:
+        """Effectue un check complet de tous les composants (résultat réutilisé pendant check_interval)"""
+        # Utilise le cache si disponible et récent, sauf demande explicite
+        cache_key = "full_health_check"
+        now = time.time()
+        cached = self.last_check_cache.get(cache_key)
+        if not force and cached and now - cached['timestamp'] < self.check_interval:
+            return replace(cached['data'], uptime=now - self.start_time)
+        
         components = []
         
         # Exécution parallèle de tous les checks
@@ -410,13 +433,21 @@ class HealthChecker:
         # Calcul de l'uptime
         uptime = time.time() - self.start_time
         
-        return SystemHealth(
+        system_health = SystemHealth(
             overall_status=overall_status,
             components=components,
             timestamp=datetime.now(),
             uptime=uptime,
             version=self.version
         )
+        
+        # Mise en cache
+        self.last_check_cache[cache_key] = {
+            'timestamp': now,
+            'data': system_health
+        }
+        
+        return system_health
     
     def _determine_overall_status(self, components: List[ComponentHealth]) -> HealthStatus:
         """Détermine le statut global basé sur les composants"""
@@ -117,13 +117,13 @@ class OptimizedLLMProvider:
             response_data = response.json()
             return self.extract_response(response_data)
 
-    async def generate_stream(self, prompt: str) -> AsyncGenerator[str, None]:
+    async def generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
         """Génère une réponse en streaming."""
         if not self.api_key:
             raise ValueError(f"Clé API manquante pour {self.provider}")
 
         headers = self.get_headers()
-        data = self.format_messages(prompt)
+        data = self.format_messages(prompt, **kwargs)
         data["stream"] = True
 
         async with httpx.AsyncClient(timeout=120.0) as client:
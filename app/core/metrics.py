@@ -4,6 +4,7 @@ Service de métriques centralisé pour le monitoring de l'API AI CSS
 """
 
 import time
+import bisect
 import psutil
 import threading
 from datetime import datetime, timedelta
@@ -14,6 +15,14 @@ from enum import Enum
 import json
 import asyncio
 from contextlib import asynccontextmanager
+import numpy as np
+
+# Codes HTTP pré-convertis en chaînes pour les labels (évite str() à chaque requête)
+_STATUS_STR = [str(i) for i in range(600)]
+
+# Bornes log-linéaires fixes des histogrammes de latence (identiques sur tous les hôtes)
+_LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_NO_LABELS: Dict[str, str] = {}
 
 class MetricType(Enum):
     """Types de métriques disponibles"""
@@ -67,17 +76,93 @@ class RAGMetrics:
     avg_total_time: float
     timestamp: datetime
 
+class MetricRingBuffer:
+    """Historique circulaire d'une métrique stocké en colonnes (valeurs, timestamps, labels)"""
+    
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = capacity
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.timestamps = np.empty(capacity, dtype=np.int64)  # nanosecondes depuis epoch
+        self.labels: List[Dict[str, str]] = [None] * capacity
+        self.metric_type: Optional[MetricType] = None
+        self.head = 0
+        self.size = 0
+    
+    def __len__(self) -> int:
+        return self.size
+    
+    def append(self, value: float, labels: Dict[str, str], metric_type: MetricType,
+               timestamp_ns: Optional[int] = None):
+        """Écrit une mesure dans le prochain emplacement en O(1)"""
+        self.values[self.head] = value
+        self.timestamps[self.head] = timestamp_ns if timestamp_ns is not None else time.time_ns()
+        self.labels[self.head] = labels
+        self.metric_type = metric_type
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+    
+    def _indices(self, limit: int) -> np.ndarray:
+        """Indices des `limit` dernières mesures, de la plus ancienne à la plus récente"""
+        count = max(0, min(limit, self.size))
+        return (np.arange(self.head - count, self.head) % self.capacity)
+    
+    def latest_values(self, limit: int) -> np.ndarray:
+        """Retourne les `limit` dernières valeurs"""
+        return self.values[self._indices(limit)]
+    
+    def to_records(self, limit: int) -> List[Dict[str, Any]]:
+        """Reconstruit les dernières mesures au format de MetricData"""
+        idx = self._indices(limit)
+        return [
+            {
+                'name': self.name,
+                'value': value,
+                'timestamp': datetime.fromtimestamp(ts / 1e9),
+                'labels': self.labels[i],
+                'metric_type': self.metric_type
+            }
+            for i, value, ts in zip(idx.tolist(), self.values[idx].tolist(), self.timestamps[idx].tolist())
+        ]
+
+
+def _summary_stats(values: List[float]) -> Dict[str, float]:
+    """Statistiques d'un histogramme/timer calculées sur un tableau trié une seule fois"""
+    arr = np.sort(np.asarray(values, dtype=np.float64))
+    n = arr.size
+    return {
+        'count': n,
+        'min': float(arr[0]),
+        'max': float(arr[-1]),
+        'avg': float(arr.mean()),
+        'p50': float(arr[n // 2]),
+        'p95': float(arr[int(n * 0.95)]),
+        'p99': float(arr[int(n * 0.99)])
+    }
+
+
 class MetricsCollector:
     """Collecteur de métriques centralisé"""
     
     def __init__(self, max_history: int = 1000):
         self.max_history = max_history
-        self.metrics_history: Dict[str, deque] = defaultdict(lambda: deque(maxlen=max_history))
+        # Historiques en colonnes (SoA) par métrique ; les snapshots système restent des objets
+        self.metrics_history: Dict[str, MetricRingBuffer] = {}
+        self.system_performance_history: deque = deque(maxlen=max_history)
         self.counters: Dict[str, float] = defaultdict(float)
         self.gauges: Dict[str, float] = defaultdict(float)
         self.histograms: Dict[str, List[float]] = defaultdict(list)
         self.timers: Dict[str, List[float]] = defaultdict(list)
         
+        # Histogrammes à buckets fixes exportés vers Prometheus : bornes par métrique et,
+        # par combinaison de labels, [comptes par bucket (+Inf en dernier), somme]
+        self.histogram_buckets: Dict[str, tuple] = {
+            "api_latency_seconds": _LATENCY_BUCKETS,
+            "api_latency_seconds_by_route": _LATENCY_BUCKETS,
+        }
+        self.bucket_counts: Dict[str, Dict[tuple, list]] = defaultdict(dict)
+        
         # Métriques spécialisées
         self.api_metrics = APIMetrics(
             total_requests=0,
@@ -108,6 +193,20 @@ class MetricsCollector:
         # Thread safety
         self._lock = threading.Lock()
         
+        # Tampons d'événements par thread pour compteurs et histogrammes : le chemin critique
+        # n'appelle qu'un deque.append (atomique), agrégé sous verrou à la lecture
+        self._local = threading.local()
+        self._pending_buffers: List[tuple] = []  # (thread, tampon), purgé quand le thread est mort
+        self._fold_threshold = 1024
+        
+        # Mémoïsation du résumé : _seq est incrémenté par chaque mutateur,
+        # le résumé n'est recalculé que si des métriques ont changé
+        self._seq = 0
+        self._cached_seq = -1
+        self._cached_summary: Optional[Dict[str, Any]] = None
+        self._cached_summary_at = 0.0
+        self._min_summary_interval = 1.0
+        
         # Démarrage de la collecte automatique
         self._start_background_collection()
     
@@ -146,58 +245,107 @@ class MetricsCollector:
             )
             
             with self._lock:
-                self.metrics_history['system_performance'].append(perf_metrics)
+                self.system_performance_history.append(perf_metrics)
                 
                 # Mise à jour des gauges
                 self.gauges['cpu_percent'] = cpu_percent
                 self.gauges['memory_percent'] = memory.percent
                 self.gauges['disk_usage_percent'] = disk.percent
+                self._seq += 1
                 
         except Exception as e:
             print(f"Erreur lors de la collecte des métriques système: {e}")
     
+    def _history(self, name: str) -> MetricRingBuffer:
+        """Retourne (en le créant si besoin) l'historique d'une métrique"""
+        history = self.metrics_history.get(name)
+        if history is None:
+            history = self.metrics_history[name] = MetricRingBuffer(name, self.max_history)
+        return history
+    
+    def _pending(self) -> deque:
+        """Tampon d'événements du thread courant (enregistré une seule fois)"""
+        buffer = getattr(self._local, "events", None)
+        if buffer is None:
+            buffer = self._local.events = deque()
+            with self._lock:
+                self._pending_buffers.append((threading.current_thread(), buffer))
+        return buffer
+    
+    def _record_pending(self, metric_type: MetricType, name: str, value: float, labels: Optional[Dict[str, str]]):
+        """Ajoute un événement au tampon du thread, sans verrou"""
+        buffer = self._pending()
+        buffer.append((metric_type, name, value, labels or {}, time.time_ns()))
+        if len(buffer) >= self._fold_threshold:
+            with self._lock:
+                self._fold_pending()
+    
+    def _record_pending_many(self, events: List[tuple]):
+        """Ajoute en un seul appel plusieurs événements (type, nom, valeur, labels) au tampon du thread"""
+        buffer = self._pending()
+        timestamp_ns = time.time_ns()
+        buffer.extend((metric_type, name, value, labels, timestamp_ns) for metric_type, name, value, labels in events)
+        if len(buffer) >= self._fold_threshold:
+            with self._lock:
+                self._fold_pending()
+    
+    def _fold_pending(self):
+        """Agrège les tampons de tous les threads (appelé verrou détenu)"""
+        folded = False
+        for _, buffer in self._pending_buffers:
+            while True:
+                try:
+                    metric_type, name, value, labels, timestamp_ns = buffer.popleft()
+                except IndexError:
+                    break
+                folded = True
+                # Un événement invalide est ignoré : il ne doit pas bloquer les lectures suivantes
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    print(f"Métrique ignorée ({name}): valeur invalide {value!r}")
+                    continue
+                if metric_type is MetricType.COUNTER:
+                    self.counters[name] += value
+                    self._history(name).append(self.counters[name], labels, metric_type, timestamp_ns)
+                else:
+                    self.histograms[name].append(value)
+                    # Garde seulement les 1000 dernières valeurs
+                    if len(self.histograms[name]) > 1000:
+                        self.histograms[name] = self.histograms[name][-1000:]
+                    self._history(name).append(value, labels, metric_type, timestamp_ns)
+                    bounds = self.histogram_buckets.get(name)
+                    if bounds is not None:
+                        self._observe_bucket(name, bounds, value, labels)
+        # Les tampons des threads terminés sont vides après l'agrégation : on les oublie
+        self._pending_buffers = [(thread, buffer) for thread, buffer in self._pending_buffers
+                                 if thread.is_alive() or buffer]
+        if folded:
+            self._seq += 1
+    
+    def _observe_bucket(self, name: str, bounds: tuple, value: float, labels: Dict[str, str]):
+        """Ajoute une observation à l'histogramme à buckets fixes (appelé verrou détenu)"""
+        key = tuple(labels.items())
+        series = self.bucket_counts[name].get(key)
+        if series is None:
+            series = self.bucket_counts[name][key] = [[0] * (len(bounds) + 1), 0.0]
+        series[0][bisect.bisect_left(bounds, value)] += 1
+        series[1] += value
+    
     def increment_counter(self, name: str, value: float = 1.0, labels: Dict[str, str] = None):
         """Incrémente un compteur"""
-        with self._lock:
-            self.counters[name] += value
-            metric = MetricData(
-                name=name,
-                value=self.counters[name],
-                timestamp=datetime.now(),
-                labels=labels or {},
-                metric_type=MetricType.COUNTER
-            )
-            self.metrics_history[name].append(metric)
+        self._record_pending(MetricType.COUNTER, name, float(value), labels)
     
     def set_gauge(self, name: str, value: float, labels: Dict[str, str] = None):
         """Définit la valeur d'une jauge"""
         with self._lock:
             self.gauges[name] = value
-            metric = MetricData(
-                name=name,
-                value=value,
-                timestamp=datetime.now(),
-                labels=labels or {},
-                metric_type=MetricType.GAUGE
-            )
-            self.metrics_history[name].append(metric)
+            self._seq += 1
+            self._history(name).append(value, labels or {}, MetricType.GAUGE)
     
     def record_histogram(self, name: str, value: float, labels: Dict[str, str] = None):
         """Enregistre une valeur dans un histogramme"""
-        with self._lock:
-            self.histograms[name].append(value)
-            # Garde seulement les 1000 dernières valeurs
-            if len(self.histograms[name]) > 1000:
-                self.histograms[name] = self.histograms[name][-1000:]
-            
-            metric = MetricData(
-                name=name,
-                value=value,
-                timestamp=datetime.now(),
-                labels=labels or {},
-                metric_type=MetricType.HISTOGRAM
-            )
-            self.metrics_history[name].append(metric)
+        self._record_pending(MetricType.HISTOGRAM, name, float(value), labels)
     
     @asynccontextmanager
     async def timer(self, name: str, labels: Dict[str, str] = None):
@@ -213,23 +361,18 @@ class MetricsCollector:
         """Enregistre une durée"""
         with self._lock:
             self.timers[name].append(duration)
+            self._seq += 1
             # Garde seulement les 1000 dernières valeurs
             if len(self.timers[name]) > 1000:
                 self.timers[name] = self.timers[name][-1000:]
             
-            metric = MetricData(
-                name=name,
-                value=duration,
-                timestamp=datetime.now(),
-                labels=labels or {},
-                metric_type=MetricType.TIMER
-            )
-            self.metrics_history[name].append(metric)
+            self._history(name).append(duration, labels or {}, MetricType.TIMER)
     
     def record_api_request(self, success: bool, response_time: float):
         """Enregistre une requête API"""
         with self._lock:
             self.api_metrics.total_requests += 1
+            self._seq += 1
             if success:
                 self.api_metrics.successful_requests += 1
             else:
@@ -251,10 +394,59 @@ class MetricsCollector:
             
             self.api_metrics.timestamp = now
     
+    def record_request_end(self, method: str, endpoint: str, status_code: int, response_time: float,
+                           error_type: Optional[str] = None):
+        """Toutes les métriques de fin de requête API : tampon sans verrou + une seule prise du verrou"""
+        # Dictionnaires de labels construits une fois et partagés entre métriques (jamais modifiés)
+        status = _STATUS_STR[status_code] if 0 <= status_code < 600 else str(status_code)
+        labels = {"method": method, "endpoint": endpoint, "status_code": status}
+        route_labels = {"method": method, "endpoint": endpoint}
+        events = [
+            (MetricType.COUNTER, "api_requests_total", 1.0, labels),
+            # Latence : un histogramme global et un par route, sans méthode ni statut
+            (MetricType.HISTOGRAM, "api_latency_seconds", response_time, _NO_LABELS),
+            (MetricType.HISTOGRAM, "api_latency_seconds_by_route", response_time, {"endpoint": endpoint}),
+        ]
+        if status_code >= 400:
+            error_labels = {**labels, "error_type": error_type} if error_type else labels
+            events.append((MetricType.COUNTER, "api_errors_total", 1.0, error_labels))
+        if response_time > 5.0:
+            events.append((MetricType.COUNTER, "api_slow_requests_total", 1.0, route_labels))
+        self._record_pending_many(events)
+        
+        self.record_api_request(status_code < 400, response_time)
+    
+    def record_rag_end(self, endpoint: str, processing_time: float, error_type: Optional[str] = None):
+        """Toutes les métriques de fin de requête RAG (succès si error_type est None)"""
+        labels = {"endpoint": endpoint, "status": "error" if error_type else "success"}
+        events = [
+            (MetricType.HISTOGRAM, "rag_processing_time_seconds", processing_time, labels),
+            (MetricType.COUNTER, "rag_queries_total", 1.0, labels),
+        ]
+        if error_type:
+            events.append((MetricType.COUNTER, "rag_errors_total", 1.0,
+                           {"endpoint": endpoint, "error_type": error_type}))
+        elif processing_time > 10.0:
+            events.append((MetricType.COUNTER, "rag_slow_queries_total", 1.0, {"endpoint": endpoint}))
+        self._record_pending_many(events)
+        
+        self.record_rag_query("rag", total_time=processing_time)
+    
+    def record_cache_event(self, endpoint: str, cache_status: str):
+        """Compteurs de hits/miss du cache signalés par l'en-tête X-Cache-Status"""
+        if cache_status not in ("hit", "miss"):
+            return
+        self._record_pending_many([
+            (MetricType.COUNTER, "cache_operations_total", 1.0, {"status": cache_status, "endpoint": endpoint}),
+            (MetricType.COUNTER, "cache_hits_total" if cache_status == "hit" else "cache_misses_total", 1.0,
+             {"endpoint": endpoint}),
+        ])
+    
     def record_rag_query(self, query_type: str, embedding_time: float = 0, llm_time: float = 0, total_time: float = 0):
         """Enregistre une requête RAG"""
         with self._lock:
             self.rag_metrics.total_queries += 1
+            self._seq += 1
             
             if query_type == "predefined_qa":
                 self.rag_metrics.predefined_qa_hits += 1
@@ -285,6 +477,7 @@ class MetricsCollector:
     def record_cache_hit(self, hit: bool):
         """Enregistre un hit/miss de cache"""
         with self._lock:
+            self._seq += 1
             if hit:
                 self.rag_metrics.cache_hits += 1
             else:
@@ -293,34 +486,27 @@ class MetricsCollector:
     def get_metrics_summary(self) -> Dict[str, Any]:
         """Retourne un résumé de toutes les métriques"""
         with self._lock:
+            self._fold_pending()
+            # Résumé en cache si rien n'a changé ou s'il est assez récent
+            now = time.monotonic()
+            if self._cached_summary is not None and (
+                self._seq == self._cached_seq
+                or now - self._cached_summary_at < self._min_summary_interval
+            ):
+                return self._cached_summary
+            
             # Calcul des statistiques pour les histogrammes et timers
-            histogram_stats = {}
-            for name, values in self.histograms.items():
-                if values:
-                    histogram_stats[name] = {
-                        'count': len(values),
-                        'min': min(values),
-                        'max': max(values),
-                        'avg': sum(values) / len(values),
-                        'p50': sorted(values)[len(values) // 2] if values else 0,
-                        'p95': sorted(values)[int(len(values) * 0.95)] if values else 0,
-                        'p99': sorted(values)[int(len(values) * 0.99)] if values else 0
-                    }
+            histogram_stats = {
+                name: _summary_stats(values)
+                for name, values in self.histograms.items() if values
+            }
             
-            timer_stats = {}
-            for name, values in self.timers.items():
-                if values:
-                    timer_stats[name] = {
-                        'count': len(values),
-                        'min': min(values),
-                        'max': max(values),
-                        'avg': sum(values) / len(values),
-                        'p50': sorted(values)[len(values) // 2] if values else 0,
-                        'p95': sorted(values)[int(len(values) * 0.95)] if values else 0,
-                        'p99': sorted(values)[int(len(values) * 0.99)] if values else 0
-                    }
+            timer_stats = {
+                name: _summary_stats(values)
+                for name, values in self.timers.items() if values
+            }
             
-            return {
+            summary = {
                 'timestamp': datetime.now().isoformat(),
                 'counters': dict(self.counters),
                 'gauges': dict(self.gauges),
@@ -328,53 +514,88 @@ class MetricsCollector:
                 'timers': timer_stats,
                 'api_metrics': asdict(self.api_metrics),
                 'rag_metrics': asdict(self.rag_metrics),
-                'system_performance': asdict(self.metrics_history['system_performance'][-1]) if self.metrics_history['system_performance'] else None
+                'system_performance': asdict(self.system_performance_history[-1]) if self.system_performance_history else None
             }
+            
+            self._cached_summary = summary
+            self._cached_seq = self._seq
+            self._cached_summary_at = now
+            return summary
     
     def get_metric_history(self, name: str, limit: int = 100) -> List[Dict[str, Any]]:
         """Retourne l'historique d'une métrique"""
         with self._lock:
-            history = list(self.metrics_history[name])[-limit:]
-            return [asdict(metric) if hasattr(metric, '__dict__') else metric for metric in history]
+            self._fold_pending()
+            if name == 'system_performance':
+                return [asdict(metric) for metric in list(self.system_performance_history)[-limit:]]
+            history = self.metrics_history.get(name)
+            return history.to_records(limit) if history is not None else []
     
     def export_prometheus_format(self) -> str:
         """Exporte les métriques au format Prometheus"""
+        # Copie cohérente sous verrou, formatage hors verrou
+        with self._lock:
+            self._fold_pending()
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            buckets = {
+                name: [(key, list(counts), total) for key, (counts, total) in self.bucket_counts[name].items()]
+                for name in self.histogram_buckets if self.bucket_counts.get(name)
+            }
+            api_metrics = APIMetrics(**asdict(self.api_metrics))
+            rag_metrics = RAGMetrics(**asdict(self.rag_metrics))
+        
         lines = []
         
         # Compteurs
-        for name, value in self.counters.items():
+        for name, value in counters.items():
             lines.append(f"# TYPE {name} counter")
             lines.append(f"{name} {value}")
         
         # Jauges
-        for name, value in self.gauges.items():
+        for name, value in gauges.items():
             lines.append(f"# TYPE {name} gauge")
             lines.append(f"{name} {value}")
         
+        # Histogrammes à buckets fixes (buckets cumulés, _sum et _count)
+        for name, series in buckets.items():
+            bounds = self.histogram_buckets[name]
+            lines.append(f"# TYPE {name} histogram")
+            for key, counts, total in series:
+                label_str = ",".join(f'{k}="{v}"' for k, v in key)
+                prefix = label_str + "," if label_str else ""
+                suffix = "{" + label_str + "}" if label_str else ""
+                cumulative = 0
+                for bound, count in zip(bounds + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{suffix} {total}")
+                lines.append(f"{name}_count{suffix} {cumulative}")
+        
         # Métriques API
         lines.extend([
             "# TYPE api_requests_total counter",
-            f"api_requests_total {self.api_metrics.total_requests}",
+            f"api_requests_total {api_metrics.total_requests}",
             "# TYPE api_requests_successful_total counter",
-            f"api_requests_successful_total {self.api_metrics.successful_requests}",
+            f"api_requests_successful_total {api_metrics.successful_requests}",
             "# TYPE api_requests_failed_total counter",
-            f"api_requests_failed_total {self.api_metrics.failed_requests}",
+            f"api_requests_failed_total {api_metrics.failed_requests}",
             "# TYPE api_response_time_avg gauge",
-            f"api_response_time_avg {self.api_metrics.avg_response_time}",
+            f"api_response_time_avg {api_metrics.avg_response_time}",
             "# TYPE api_requests_per_minute gauge",
-            f"api_requests_per_minute {self.api_metrics.requests_per_minute}"
+            f"api_requests_per_minute {api_metrics.requests_per_minute}"
         ])
         
         # Métriques RAG
         lines.extend([
             "# TYPE rag_queries_total counter",
-            f"rag_queries_total {self.rag_metrics.total_queries}",
+            f"rag_queries_total {rag_metrics.total_queries}",
             "# TYPE rag_predefined_qa_hits counter",
-            f"rag_predefined_qa_hits {self.rag_metrics.predefined_qa_hits}",
+            f"rag_predefined_qa_hits {rag_metrics.predefined_qa_hits}",
             "# TYPE rag_cache_hits counter",
-            f"rag_cache_hits {self.rag_metrics.cache_hits}",
+            f"rag_cache_hits {rag_metrics.cache_hits}",
             "# TYPE rag_cache_misses counter",
-            f"rag_cache_misses {self.rag_metrics.cache_misses}"
+            f"rag_cache_misses {rag_metrics.cache_misses}"
         ])
         
         return "\n".join(lines)
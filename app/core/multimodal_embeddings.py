@@ -90,10 +90,18 @@ class MultimodalEmbeddings:
             logger.error(f"Erreur génération caption: {e}")
             return ""
     
-    def extract_text_from_image(self, image: Image.Image) -> str:
-        """Extraction de texte d'image avec OCR"""
+    def generate_image_captions_batch(self, images: List[Union[Image.Image, np.ndarray]]) -> List[Optional[str]]:
+        """Génération de descriptions pour un lot d'images avec BLIP (None en cas d'échec)"""
+        try:
+            return self.multimodal_models.generate_image_captions_batch(images)
+        except Exception as e:
+            logger.error(f"Erreur génération captions par lot: {e}")
+            return [None] * len(images)
+    
+    def extract_text_from_image(self, image: Image.Image) -> Optional[str]:
+        """Extraction de texte d'image avec OCR (None en cas d'échec)"""
         try:
             return self.multimodal_models.extract_text_from_image(image)
         except Exception as e:
             logger.error(f"Erreur extraction texte OCR: {e}")
-            return ""
\ No newline at end of file
+            return None
\ No newline at end of file
@@ -1,13 +1,22 @@
+import threading
 import torch
 from PIL import Image
 import pytesseract
 from transformers import BlipProcessor, BlipForConditionalGeneration
 from transformers import CLIPProcessor, CLIPModel
 import numpy as np
+from typing import List, Union
 
 from app.core.config import settings
 from app.utils.logging import logger
 
+# API Tesseract in-process (optionnelle) : évite un fork de tesseract par image
+try:
+    import tesserocr
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    TESSEROCR_AVAILABLE = False
+
 
 # Classe pour gérer les modèles multimodaux
 class MultimodalModels:
@@ -21,6 +30,12 @@ class MultimodalModels:
         self._clip_processor = None
         self._blip_model = None
         self._blip_processor = None
+        # Tampon d'entrée BLIP réutilisé d'une image à l'autre (même résolution)
+        self._caption_input = None
+        self._caption_lock = threading.Lock()
+        self._ocr_api = None
+        self._ocr_failed = False
+        self._ocr_lock = threading.Lock()  # PyTessBaseAPI n'est pas thread-safe
 
     def _load_clip(self):
         """Chargement lazy du modèle CLIP"""
@@ -46,6 +61,22 @@ class MultimodalModels:
                 logger.error(f"Erreur chargement BLIP: {e}")
                 raise
 
+    def _load_ocr(self):
+        """Chargement lazy du moteur Tesseract in-process (tesserocr)"""
+        if self._ocr_api is None and TESSEROCR_AVAILABLE and not self._ocr_failed:
+            try:
+                # Équivalent de '--oem 3 --psm 6 -l fra+eng'
+                self._ocr_api = tesserocr.PyTessBaseAPI(
+                    lang='fra+eng',
+                    psm=tesserocr.PSM.SINGLE_BLOCK,
+                    oem=tesserocr.OEM.DEFAULT
+                )
+                logger.info("Moteur OCR tesserocr chargé avec succès")
+            except Exception as e:
+                self._ocr_failed = True
+                logger.warning(f"tesserocr indisponible, repli sur pytesseract: {e}")
+        return self._ocr_api
+
     def encode_image(self, image: Image.Image) -> np.ndarray:
         """Encodage d'image avec CLIP"""
         self._load_clip()
@@ -82,20 +113,31 @@ class MultimodalModels:
 
     def generate_image_caption(self, image: Image.Image) -> str:
         """Génération de description d'image avec BLIP"""
+        return self.generate_image_captions_batch([image])[0]
+
+    def generate_image_captions_batch(self, images: List[Union[Image.Image, np.ndarray]]) -> List[str]:
+        """Génération de descriptions pour un lot d'images en un seul appel BLIP"""
         self._load_blip()
-        inputs = self._blip_processor(image, return_tensors="pt").to(self.device)
-        with torch.no_grad():
-            out = self._blip_model.generate(**inputs, max_length=100, num_beams=5)
-        caption = self._blip_processor.decode(out[0], skip_special_tokens=True)
-        return caption
+        pixel_values = self._blip_processor(images=images, return_tensors="pt")["pixel_values"]
+        with self._caption_lock, torch.no_grad():
+            # Copie dans le tampon préalloué sur le device au lieu d'une allocation par lot
+            if self._caption_input is None or self._caption_input.shape != pixel_values.shape:
+                self._caption_input = torch.empty(
+                    pixel_values.shape, dtype=pixel_values.dtype, device=self.device
+                )
+            self._caption_input.copy_(pixel_values)
+            out = self._blip_model.generate(pixel_values=self._caption_input, max_length=100, num_beams=5)
+        return self._blip_processor.batch_decode(out, skip_special_tokens=True)
 
     def extract_text_from_image(self, image: Image.Image) -> str:
-        """Extraction de texte avec OCR"""
-        try:
-            # Configuration OCR pour le français
-            custom_config = r'--oem 3 --psm 6 -l fra+eng'
-            text = pytesseract.image_to_string(image, config=custom_config)
-            return text.strip()
-        except Exception as e:
-            logger.error(f"Erreur OCR: {e}")
-            return ""
+        """Extraction de texte avec OCR (les erreurs sont propagées à l'appelant)"""
+        ocr_api = self._load_ocr()
+        if ocr_api is not None:
+            with self._ocr_lock:
+                ocr_api.SetImage(image)
+                return ocr_api.GetUTF8Text().strip()
+
+        # Configuration OCR pour le français
+        custom_config = r'--oem 3 --psm 6 -l fra+eng'
+        text = pytesseract.image_to_string(image, config=custom_config)
+        return text.strip()
@@ -1,75 +1,270 @@
 import io
+import re
 import uuid
-from typing import Dict, Any, List, Optional
+import asyncio
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Union
+import numpy as np
 from PIL import Image
-from pathlib import Path
 
 from app.services.document_service import process_document_advanced
 from app.core.multimodal_embeddings import MultimodalEmbeddings
 from app.models.enums import ContentType, ModalityType
 from app.utils.logging import logger
 
+_LEADING_WS = re.compile(r'\s*')
+
+# Valeurs d'énumérations résolues une seule fois
+_CT_IMAGE = ContentType.IMAGE.value
+_CT_DOCUMENT = ContentType.DOCUMENT.value
+_MOD_IMAGE = ModalityType.IMAGE.value
+_MOD_TEXT = ModalityType.TEXT.value
+
+# Résolution maximale utile pour l'OCR et la génération de description
+_IMAGE_MAX_SIZE = (1024, 1024)
+
+# Décodeur Pillow imposé d'après l'extension, pour éviter le sondage de tous les formats
+_PIL_FORMATS = {
+    'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'gif': 'GIF',
+    'bmp': 'BMP', 'tiff': 'TIFF', 'webp': 'WEBP'
+}
+
+# Pré-filtre OCR : en deçà de ce nombre de transitions de luminance franches,
+# l'image (aplat, dégradé, fond uni) ne peut pas contenir de texte lisible
+_OCR_EDGE_DELTA = 32
+_OCR_MIN_EDGE_PIXELS = 8
+
+
+@dataclass(slots=True)
+class ProcessedDoc:
+    """Résultat du traitement d'un document multimodal"""
+    content: str
+    metadata: Dict[str, Any]
+    caption: str = ""
+    ocr_text: str = ""
+    image: Optional[Image.Image] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Représentation sérialisable (sans l'image décodée)"""
+        return {
+            "content": self.content,
+            "metadata": self.metadata,
+            "caption": self.caption,
+            "ocr_text": self.ocr_text
+        }
+
+
+def _may_contain_text(image: Image.Image) -> bool:
+    """Test bon marché de présence de texte : compte les gradients de luminance francs"""
+    gray = np.asarray(image.convert('L'), dtype=np.int16)
+    edges = np.count_nonzero(np.abs(np.diff(gray, axis=1)) > _OCR_EDGE_DELTA)
+    if edges >= _OCR_MIN_EDGE_PIXELS:
+        return True
+    edges += np.count_nonzero(np.abs(np.diff(gray, axis=0)) > _OCR_EDGE_DELTA)
+    return edges >= _OCR_MIN_EDGE_PIXELS
+
+
+def _file_extension(filename: str) -> str:
+    """Extension en minuscules sans le point ('' si absente), sans construire de Path"""
+    _, sep, ext = filename.rpartition('.')
+    return ext.lower() if sep else ''
+
 
 class MultimodalProcessor:
     """Classe pour traiter les documents multimodaux"""
     
+    SUPPORTED_IMAGE_EXTS = frozenset({'jpg', 'jpeg', 'png', 'gif', 'bmp', 'tiff', 'webp'})
+    SUPPORTED_DOC_EXTS = frozenset({'pdf', 'doc', 'docx', 'txt'})
+    
     def __init__(self, multimodal_embeddings: MultimodalEmbeddings):
         self.multimodal_embeddings = multimodal_embeddings
-        self.supported_image_types = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'}
-        self.supported_document_types = {'.pdf', '.doc', '.docx', '.txt'}
+        self.supported_image_types = frozenset(f'.{ext}' for ext in self.SUPPORTED_IMAGE_EXTS)
+        self.supported_document_types = frozenset(f'.{ext}' for ext in self.SUPPORTED_DOC_EXTS)
+        
+        # Extension -> traitement, pour un aiguillage en une seule recherche
+        self._dispatch = {
+            **{ext: self.process_image_document for ext in self.SUPPORTED_IMAGE_EXTS},
+            **{ext: self._process_document_file for ext in self.SUPPORTED_DOC_EXTS}
+        }
+        
+        # Cache LRU des résultats OCR/caption indexé par le hash des pixels décodés
+        self._mm_cache: OrderedDict = OrderedDict()
+        self._mm_cache_max_items = 1024
+        
+        # Pools dédiés à la vision : OCR en parallèle, caption sérialisée (modèle GPU)
+        self._vision_pool = ThreadPoolExecutor(max_workers=2)
+        self._caption_pool = ThreadPoolExecutor(max_workers=1)
+        
+        # Micro-batching des captions : les images des uploads concurrents sont
+        # regroupées (jusqu'à N images ou T secondes) en un seul appel BLIP
+        self._caption_batch_size = 8
+        self._caption_batch_wait = 0.01
+        self._caption_queue: Optional[asyncio.Queue] = None
+        self._caption_worker: Optional[asyncio.Task] = None
+    
+    def _image_cache_key(self, pixels: np.ndarray) -> bytes:
+        """Empreinte du contenu de l'image (pixels + dimensions), hachée sans copie"""
+        digest = hashlib.sha256(pixels)
+        digest.update(f"{pixels.shape}".encode())
+        return digest.digest()
+    
+    def _cache_image_results(self, key: bytes, results: Dict[str, Optional[str]]):
+        """Stocke les résultats OCR/caption en évinçant les entrées les plus anciennes"""
+        self._mm_cache[key] = results
+        self._mm_cache.move_to_end(key)
+        while len(self._mm_cache) > self._mm_cache_max_items:
+            self._mm_cache.popitem(last=False)
+    
+    async def _enqueue_caption(self, image: Union[Image.Image, np.ndarray]) -> Optional[str]:
+        """Soumet une image au lot de captions courant et attend sa description (None si échec)"""
+        if self._caption_worker is None or self._caption_worker.done():
+            self._caption_queue = asyncio.Queue()
+            self._caption_worker = asyncio.create_task(self._caption_batch_loop(self._caption_queue))
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._caption_queue.put((image, future))
+        return await future
+    
+    async def _caption_batch_loop(self, queue: asyncio.Queue):
+        """Tâche de fond : vide la file par lots et génère les captions en un appel"""
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await queue.get()]
+            deadline = loop.time() + self._caption_batch_wait
+            while len(items) < self._caption_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            images = [image for image, _ in items]
+            try:
+                captions = await loop.run_in_executor(
+                    self._caption_pool, self.multimodal_embeddings.generate_image_captions_batch, images
+                )
+            except Exception as e:
+                logger.error(f"Erreur génération captions par lot: {e}")
+                captions = [None] * len(items)
+            
+            for (_, future), caption in zip(items, captions):
+                if not future.done():
+                    future.set_result(caption)
+    
+    def _open_image(self, image_content: bytes, filename: str) -> Image.Image:
+        """Ouvre l'image avec le décodeur attendu, puis sondage complet si l'extension ment"""
+        pil_format = _PIL_FORMATS.get(_file_extension(filename))
+        if pil_format is not None:
+            try:
+                return Image.open(io.BytesIO(image_content), formats=(pil_format,))
+            except Image.UnidentifiedImageError:
+                pass
+        return Image.open(io.BytesIO(image_content))
+    
+    def _prepare_image(self, image_content: bytes, filename: str, extract_text: bool):
+        """Décodage, réduction et pré-filtre OCR de l'image (bloquant, libère le GIL dans Pillow)"""
+        # Chargement de l'image : décodage JPEG réduit (draft) puis plafonnement
+        # de la résolution avant conversion, les modèles n'exploitant pas plus
+        image = self._open_image(image_content, filename)
+        original_size = image.size
+        image.draft('RGB', _IMAGE_MAX_SIZE)
+        image.thumbnail(_IMAGE_MAX_SIZE, Image.Resampling.LANCZOS)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        # Une seule copie contiguë HxWx3 uint8, partagée par le hash et le modèle de caption
+        pixels = np.asarray(image)
+        may_have_text = extract_text and _may_contain_text(image)
+        return image, original_size, pixels, self._image_cache_key(pixels), may_have_text
     
     def is_image_file(self, filename: str) -> bool:
         """Vérifie si le fichier est une image supportée"""
-        return Path(filename).suffix.lower() in self.supported_image_types
+        return _file_extension(filename) in self.SUPPORTED_IMAGE_EXTS
     
     def is_document_file(self, filename: str) -> bool:
         """Vérifie si le fichier est un document supporté"""
-        return Path(filename).suffix.lower() in self.supported_document_types
+        return _file_extension(filename) in self.SUPPORTED_DOC_EXTS
     
     async def process_multimodal_document(self, file_content: bytes, filename: str, 
                                          extract_text: bool = True, 
-                                         generate_captions: bool = True) -> Dict[str, Any]:
+                                         generate_captions: bool = True) -> ProcessedDoc:
         """Traite un document multimodal (image ou document)"""
-        
-        if self.is_image_file(filename):
-            return self.process_image_document(file_content, filename, extract_text, generate_captions)
-        elif self.is_document_file(filename):
-            return await self.process_text_document(file_content, filename)
-        else:
+        handler = self._dispatch.get(_file_extension(filename))
+        if handler is None:
             raise ValueError(f"Type de fichier non supporté: {filename}")
+        return await handler(file_content, filename, extract_text, generate_captions)
+    
+    async def _process_document_file(self, file_content: bytes, filename: str,
+                                     extract_text: bool = True,
+                                     generate_captions: bool = True) -> ProcessedDoc:
+        """Adaptateur de signature pour l'aiguillage : les options image sont ignorées"""
+        return await self.process_text_document(file_content, filename)
     
-    def process_image_document(self, image_content: bytes, filename: str, 
-                              extract_text: bool = True, 
-                              generate_captions: bool = True) -> Dict[str, Any]:
-        """Traite un document image"""
+    async def process_image_document(self, image_content: bytes, filename: str, 
+                                    extract_text: bool = True, 
+                                    generate_captions: bool = True) -> ProcessedDoc:
+        """Traite un document image (OCR et caption exécutés hors de la boucle d'événements)"""
         try:
-            # Chargement de l'image
-            image = Image.open(io.BytesIO(image_content))
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+            # Décodage, réduction, hachage et pré-filtre OCR hors de la boucle d'événements :
+            # les uploads concurrents sont traités en parallèle
+            image, original_size, pixels, cache_key, may_have_text = await asyncio.to_thread(
+                self._prepare_image, image_content, filename, extract_text
+            )
             
             # Métadonnées de base
             metadata = {
                 "filename": filename,
-                "content_type": ContentType.IMAGE.value,
-                "modality": ModalityType.IMAGE.value,
-                "image_size": image.size,
+                "content_type": _CT_IMAGE,
+                "modality": _MOD_IMAGE,
+                "image_size": original_size,
                 "image_mode": image.mode,
                 "file_size": len(image_content)
             }
             
-            # Extraction de texte avec OCR
+            # Résultats déjà calculés pour une image identique
+            cached = self._mm_cache.get(cache_key) or {"ocr_text": None, "caption": None}
+            
+            # OCR et caption lancés en parallèle dans les pools de vision
+            loop = asyncio.get_running_loop()
+            ocr_task = None
+            if extract_text and cached["ocr_text"] is None:
+                if may_have_text:
+                    ocr_task = loop.run_in_executor(
+                        self._vision_pool, self.multimodal_embeddings.extract_text_from_image, image
+                    )
+                else:
+                    cached["ocr_text"] = ""
+                    metadata["ocr_skipped"] = True
+            caption_task = None
+            if generate_captions and cached["caption"] is None:
+                caption_task = asyncio.ensure_future(self._enqueue_caption(pixels))
+            mm_cache_hit = ocr_task is None and caption_task is None and "ocr_skipped" not in metadata
+            
+            # Extraction de texte avec OCR (un échec reste à None dans le cache pour être retenté)
             ocr_text = ""
             if extract_text:
-                ocr_text = self.multimodal_embeddings.extract_text_from_image(image)
+                if ocr_task is not None:
+                    cached["ocr_text"] = await ocr_task
+                ocr_text = cached["ocr_text"] or ""
                 metadata["has_ocr_text"] = len(ocr_text.strip()) > 0
             
             # Génération de description
             caption = ""
             if generate_captions:
-                caption = self.multimodal_embeddings.generate_image_caption(image)
+                if caption_task is not None:
+                    cached["caption"] = await caption_task
+                caption = cached["caption"] or ""
                 metadata["has_caption"] = len(caption.strip()) > 0
             
+            if cached["ocr_text"] is not None or cached["caption"] is not None:
+                self._cache_image_results(cache_key, cached)
+            metadata["mm_cache_hit"] = mm_cache_hit
+            
             # Contenu combiné pour la recherche
             searchable_content = f"Image: {filename}"
             if caption:
@@ -77,19 +272,19 @@ class MultimodalProcessor:
             if ocr_text:
                 searchable_content += f"\nTexte extrait: {ocr_text}"
             
-            return {
-                "content": searchable_content,
-                "caption": caption,
-                "ocr_text": ocr_text,
-                "image": image,
-                "metadata": metadata
-            }
+            return ProcessedDoc(
+                content=searchable_content,
+                metadata=metadata,
+                caption=caption,
+                ocr_text=ocr_text,
+                image=image
+            )
             
         except Exception as e:
             logger.error(f"Erreur traitement image {filename}: {e}")
             raise
     
-    async def process_text_document(self, document_content: bytes, filename: str) -> Dict[str, Any]:
+    async def process_text_document(self, document_content: bytes, filename: str) -> ProcessedDoc:
         """Traite un document texte"""
         try:
             # Extraction du texte du document
@@ -98,99 +293,109 @@ class MultimodalProcessor:
             # Métadonnées
             metadata = {
                 "filename": filename,
-                "content_type": ContentType.DOCUMENT.value,
-                "modality": ModalityType.TEXT.value,
+                "content_type": _CT_DOCUMENT,
+                "modality": _MOD_TEXT,
                 "file_size": len(document_content),
                 "text_length": len(text_content)
             }
             
-            return {
-                "content": text_content,
-                "metadata": metadata
-            }
+            return ProcessedDoc(content=text_content, metadata=metadata)
             
         except Exception as e:
             logger.error(f"Erreur traitement document {filename}: {e}")
             raise
     
-    def create_multimodal_chunks(self, processed_data: Dict[str, Any], 
+    def create_multimodal_chunks(self, processed_data: ProcessedDoc, 
                                 document_id: str) -> List[Dict[str, Any]]:
         """Crée des chunks pour les données multimodales"""
         chunks = []
         
-        content_type = processed_data["metadata"]["content_type"]
+        metadata = processed_data.metadata
+        content_type = metadata["content_type"]
         
-        if content_type == ContentType.IMAGE.value:
+        if content_type == _CT_IMAGE:
+            content = processed_data.content
+            caption = processed_data.caption
+            ocr_text = processed_data.ocr_text
+            base_metadata = {**metadata, "document_id": document_id}
+            
             # Pour les images, on crée un chunk principal avec toutes les informations
-            chunk_data = {
+            chunks.append({
                 "id": f"{document_id}_image_main",
-                "content": processed_data["content"],
-                "metadata": {
-                    **processed_data["metadata"],
-                    "document_id": document_id,
-                    "chunk_type": "image_main",
-                    "chunk_length": len(processed_data["content"]),
-                    "caption": processed_data.get("caption", ""),
-                    "ocr_text": processed_data.get("ocr_text", "")
-                }
-            }
-            chunks.append(chunk_data)
+                "content": content,
+                "metadata": dict(
+                    base_metadata,
+                    chunk_type="image_main",
+                    chunk_length=len(content),
+                    caption=caption,
+                    ocr_text=ocr_text
+                )
+            })
             
             # Chunk séparé pour la description si elle existe
-            if processed_data.get("caption"):
-                caption_chunk = {
+            if caption:
+                chunks.append({
                     "id": f"{document_id}_caption",
-                    "content": f"Description de l'image: {processed_data['caption']}",
-                    "metadata": {
-                        **processed_data["metadata"],
-                        "document_id": document_id,
-                        "chunk_type": "image_caption",
-                        "chunk_length": len(processed_data['caption']),
-                        "modality": ModalityType.TEXT.value
-                    }
-                }
-                chunks.append(caption_chunk)
+                    "content": f"Description de l'image: {caption}",
+                    "metadata": dict(
+                        base_metadata,
+                        chunk_type="image_caption",
+                        chunk_length=len(caption),
+                        modality=_MOD_TEXT
+                    )
+                })
             
             # Chunk séparé pour le texte OCR si il existe
-            if processed_data.get("ocr_text") and len(processed_data["ocr_text"].strip()) > 10:
-                ocr_chunk = {
+            if ocr_text and len(ocr_text.strip()) > 10:
+                chunks.append({
                     "id": f"{document_id}_ocr",
-                    "content": f"Texte extrait de l'image: {processed_data['ocr_text']}",
-                    "metadata": {
-                        **processed_data["metadata"],
-                        "document_id": document_id,
-                        "chunk_type": "image_ocr",
-                        "chunk_length": len(processed_data['ocr_text']),
-                        "modality": ModalityType.TEXT.value
-                    }
-                }
-                chunks.append(ocr_chunk)
+                    "content": f"Texte extrait de l'image: {ocr_text}",
+                    "metadata": dict(
+                        base_metadata,
+                        chunk_type="image_ocr",
+                        chunk_length=len(ocr_text),
+                        modality=_MOD_TEXT
+                    )
+                })
         
-        elif content_type == ContentType.DOCUMENT.value:
+        elif content_type == _CT_DOCUMENT:
             # Pour les documents texte, on utilise le chunking standard
             # mais on adapte les métadonnées pour le multimodal
-            text_content = processed_data["content"]
+            text_content = processed_data.content
             
             # Chunking simple pour les documents texte
             chunk_size = 1000
             overlap = 200
+            stride = chunk_size - overlap
+            text_length = len(text_content)
+            base_metadata = {
+                **metadata,
+                "document_id": document_id,
+                "chunk_type": "text_chunk"
+            }
+            id_prefix = f"{document_id}_text_"
             
-            for i in range(0, len(text_content), chunk_size - overlap):
-                chunk_text = text_content[i:i + chunk_size]
-                if len(chunk_text.strip()) < 50:  # Skip très petits chunks
+            for i in range(0, text_length, stride):
+                end = min(i + chunk_size, text_length)
+                
+                # Les blancs de tête sont mesurés sans copier la fenêtre : les très
+                # petits chunks sont écartés avant toute allocation
+                start = _LEADING_WS.match(text_content, i, end).end()
+                if end - start < 50:
+                    continue
+                
+                chunk_text = text_content[i:end]
+                if len(chunk_text.rstrip()) - (start - i) < 50:  # Skip très petits chunks
                     continue
                 
-                chunk_data = {
-                    "id": f"{document_id}_text_{i}",
+                chunks.append({
+                    "id": id_prefix + str(i),
                     "content": chunk_text,
                     "metadata": {
-                        **processed_data["metadata"],
-                        "document_id": document_id,
-                        "chunk_type": "text_chunk",
-                        "chunk_index": i // (chunk_size - overlap),
+                        **base_metadata,
+                        "chunk_index": i // stride,
                         "chunk_length": len(chunk_text)
                     }
-                }
-                chunks.append(chunk_data)
+                })
         
         return chunks
\ No newline at end of file
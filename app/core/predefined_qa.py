@@ -1,6 +1,9 @@
 from typing import Dict, List, Optional, Tuple
 import re
-from difflib import SequenceMatcher
+import ahocorasick
+import numpy as np
+from collections import Counter, defaultdict
+from rapidfuzz import fuzz, process
 from app.utils.logging import logger
 
 class PredefinedQASystem:
@@ -181,50 +184,95 @@ class PredefinedQASystem:
             "allocations": ["prestations", "indemnités", "aides"],
             "remboursement": ["remboursé", "rembourser", "prise en charge"]
         }
+        
+        # Normalisation précompilée : table de ponctuation + une seule regex de synonymes
+        self._punct_table = str.maketrans('', '', '?!.,;:')
+        self._build_synonym_index()
+        self._build_match_index()
     
-    def normalize_question(self, question: str) -> str:
-        """Normalise une question pour améliorer la correspondance"""
-        # Convertir en minuscules
-        question = question.lower().strip()
+    def _build_synonym_index(self):
+        """Compile tous les synonymes en une alternation unique (plus longs d'abord)"""
+        self._syn_map = {
+            synonym: key
+            for key, synonyms in self.synonyms.items()
+            for synonym in synonyms
+        }
+        self._syn_re = re.compile(
+            '|'.join(re.escape(s) for s in sorted(self._syn_map, key=len, reverse=True))
+        )
+    
+    def _build_match_index(self):
+        """Précalcule la liste des questions et un automate Aho-Corasick des mots-clés"""
+        self._keys = list(self.qa_database.keys())
         
-        # Supprimer la ponctuation
-        question = re.sub(r'[?!.,;:]', '', question)
+        # mot-clé -> [(index de la question, nombre d'occurrences dans ses mots-clés)]
+        keyword_entries = defaultdict(list)
+        for index, qa_data in enumerate(self.qa_database.values()):
+            for keyword, count in Counter(kw.lower() for kw in qa_data["keywords"]).items():
+                keyword_entries[keyword].append((index, count))
         
-        # Remplacer les synonymes
-        for key, synonyms in self.synonyms.items():
-            for synonym in synonyms:
-                question = question.replace(synonym, key)
+        self._keyword_automaton = None
+        if keyword_entries:
+            automaton = ahocorasick.Automaton()
+            for keyword, entries in keyword_entries.items():
+                automaton.add_word(keyword, (keyword, entries))
+            automaton.make_automaton()
+            self._keyword_automaton = automaton
+    
+    def _keyword_bonuses(self, normalized_question: str) -> Dict[int, float]:
+        """Bonus de mots-clés par question, calculé en une seule passe sur la requête"""
+        bonuses = defaultdict(float)
+        if self._keyword_automaton is None:
+            return bonuses
+        
+        found = {}
+        for _, (keyword, entries) in self._keyword_automaton.iter(normalized_question):
+            found[keyword] = entries
         
-        return question
+        for entries in found.values():
+            for index, count in entries:
+                bonuses[index] += 0.1 * count
+        return bonuses
+    
+    def normalize_question(self, question: str) -> str:
+        """Normalise une question pour améliorer la correspondance"""
+        # Convertir en minuscules et supprimer la ponctuation
+        question = question.lower().strip().translate(self._punct_table)
+        
+        # Remplacer les synonymes en une seule passe
+        return self._syn_re.sub(lambda m: self._syn_map[m.group(0)], question)
     
     def calculate_similarity(self, question1: str, question2: str) -> float:
         """Calcule la similarité entre deux questions"""
-        return SequenceMatcher(None, question1, question2).ratio()
+        return fuzz.ratio(question1, question2) / 100.0
+    
+    def calculate_similarities(self, question: str, candidates: List[str]) -> np.ndarray:
+        """Calcule en lot la similarité d'une question avec chaque candidate"""
+        return process.cdist([question], candidates, scorer=fuzz.ratio, dtype=np.float64)[0] / 100.0
     
     def find_best_match(self, user_question: str, threshold: float = 0.7) -> Optional[Tuple[str, Dict]]:
         """Trouve la meilleure correspondance pour une question utilisateur"""
         normalized_question = self.normalize_question(user_question)
         
-        best_match = None
-        best_score = 0.0
+        if not self._keys:
+            return None
         
-        for predefined_question, qa_data in self.qa_database.items():
-            # Similarité directe avec la question prédéfinie
-            similarity = self.calculate_similarity(normalized_question, predefined_question)
-            
-            # Bonus si des mots-clés sont présents
-            keyword_bonus = 0.0
-            for keyword in qa_data["keywords"]:
-                if keyword.lower() in normalized_question:
-                    keyword_bonus += 0.1
-            
-            total_score = similarity + min(keyword_bonus, 0.3)  # Limiter le bonus à 0.3
-            
-            if total_score > best_score and total_score >= threshold:
-                best_score = total_score
-                best_match = (predefined_question, qa_data)
+        # Similarités de toutes les questions calculées en un seul appel vectorisé
+        similarities = self.calculate_similarities(normalized_question, self._keys)
+        
+        # Bonus si des mots-clés sont présents (limité à 0.3)
+        bonuses = np.zeros(len(self._keys))
+        for index, bonus in self._keyword_bonuses(normalized_question).items():
+            bonuses[index] = min(bonus, 0.3)
+        
+        total_scores = similarities + bonuses
+        best_index = int(np.argmax(total_scores))  # Premier maximum, comme le parcours séquentiel
+        best_score = total_scores[best_index]
+        if best_score < threshold or best_score <= 0.0:
+            return None
         
-        return best_match if best_match else None
+        predefined_question = self._keys[best_index]
+        return (predefined_question, self.qa_database[predefined_question])
     
     def get_predefined_answer(self, user_question: str, threshold: float = 0.7) -> Optional[Dict]:
         """Récupère une réponse prédéfinie si elle existe"""
@@ -252,6 +300,7 @@ class PredefinedQASystem:
             "keywords": keywords,
             "confidence": confidence
         }
+        self._build_match_index()
         logger.info(f"Nouvelle Q&A ajoutée: {question}")
     
     def get_all_questions(self) -> List[str]:
@@ -1,4 +1,5 @@
-from typing import List
+import asyncio
+from typing import Dict, List
 from app.core.cache import cache
 from app.utils.logging import logger
 
@@ -6,7 +7,9 @@ from app.utils.logging import logger
 # Query Enhancement
 class QueryEnhancer:
     def __init__(self):
-        self.enhancement_cache = {}
+        # Enrichissements en cours : les appels concurrents sur la même requête
+        # attendent le même résultat au lieu de relancer le LLM
+        self._inflight: Dict[str, asyncio.Future] = {}
 
     async def enhance_query(self, query: str, provider_instance) -> List[str]:
         """Génération de variantes de requête pour améliorer la recherche"""
@@ -15,6 +18,23 @@ class QueryEnhancer:
         if cached:
             return cached
 
+        inflight = self._inflight.get(query)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[query] = future
+        try:
+            all_queries = await self._generate_variants(query, provider_instance)
+            future.set_result(all_queries)
+            return all_queries
+        finally:
+            if not future.done():
+                future.set_result([query])  # Annulation : fallback pour les appels en attente
+            self._inflight.pop(query, None)
+
+    async def _generate_variants(self, query: str, provider_instance) -> List[str]:
+        """Appel LLM générant les variantes puis mise en cache"""
         try:
             enhancement_prompt = f"""Vous êtes un expert en reformulation de requêtes pour améliorer la recherche documentaire.
 
@@ -6,8 +6,10 @@ Permet de déterminer le type de question et d'adapter la stratégie de réponse
 """
 
 import re
+import functools
+import ahocorasick
 from enum import Enum
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Set
 from dataclasses import dataclass
 
 
@@ -71,6 +73,26 @@ class QuestionClassifier:
                 r"\b(cotisation|contribution)\b"
             ]
         }
+        # Une seule regex compilée par type (alternatives disjointes, donc même décompte).
+        # La question est déjà en minuscules : pas besoin de re.IGNORECASE
+        self._type_re = {
+            q_type: re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+            for q_type, patterns in self.patterns.items()
+        }
+
+        # Discriminants forts : un seul type touché suffit à trancher sans calculer tous les scores
+        strong_discriminators = {
+            QuestionType.PROCEDURAL: r"\b(comment|procédure|démarche|étapes)\b",
+            QuestionType.COMPARATIVE: r"\b(différence|comparaison|versus|vs|plutôt que|au lieu de)\b",
+            QuestionType.DEFINITION: r"\b(qu'est-ce que|que signifie|définition|c'est quoi|signification)\b",
+            QuestionType.STATUS: r"\b(statut)\b",
+        }
+        self._strong_types = {q_type.value: q_type for q_type in strong_discriminators}
+        self._strong_re = re.compile("|".join(
+            f"(?P<{q_type.value}>{pattern})" for q_type, pattern in strong_discriminators.items()
+        ))
+        self._num_re = re.compile(r'\b\d+\b')
+        self._important_re = re.compile(r'\b(retraite|pension|allocation|cotisation|prestation|dossier|demande)\b')
 
         self.css_keywords = [
             "css", "caisse", "sécurité sociale", "retraite", "pension",
@@ -82,18 +104,36 @@ class QuestionClassifier:
             "quel est", "quelle est", "combien", "où", "quand", "qui"
         ]
 
+        # Mots-clés permettant de répondre sans LLM
+        self._skip_kw = frozenset({"âge", "retraite", "montant"})
+
+        # Automate unique pour tous les mots-clés (un seul parcours de la question)
+        self._keyword_automaton = ahocorasick.Automaton()
+        for category, words in (("css", self.css_keywords), ("simple", self.simple_question_indicators)):
+            for word in words:
+                self._keyword_automaton.add_word(word, (category, word))
+        self._keyword_automaton.make_automaton()
+
+        # Cache des classifications (lru_cache lié à l'instance pour ne pas retenir self globalement)
+        self._classify_cached = functools.lru_cache(maxsize=4096)(self._classify_impl)
+
     def classify(self, question: str) -> ClassificationResult:
         """Classifie une question et détermine la stratégie optimale"""
-        question_lower = question.lower().strip()
+        return self._classify_cached(question.lower().strip())
 
+    def _classify_impl(self, question_lower: str) -> ClassificationResult:
+        """Classification complète d'une question déjà normalisée"""
         # Détection du type de question
         question_type = self._detect_question_type(question_lower)
 
+        # Recherche des mots-clés connus en une passe
+        keyword_hits = self._scan_keywords(question_lower)
+
         # Calcul de la confiance
-        confidence = self._calculate_confidence(question_lower, question_type)
+        confidence = self._calculate_confidence(question_lower, question_type, keyword_hits)
 
         # Extraction des mots-clés
-        keywords = self._extract_keywords(question_lower)
+        keywords = self._extract_keywords(question_lower, keyword_hits)
 
         # Stratégie suggérée
         strategy = self._suggest_strategy(question_type, confidence)
@@ -111,14 +151,17 @@ class QuestionClassifier:
 
     def _detect_question_type(self, question: str) -> QuestionType:
         """Détecte le type de question basé sur les patterns"""
-        scores = {}
-
-        for q_type, patterns in self.patterns.items():
-            score = 0
-            for pattern in patterns:
-                matches = len(re.findall(pattern, question, re.IGNORECASE))
-                score += matches
-            scores[q_type] = score
+        # Chemin rapide : exactement un type désigné par un discriminant fort
+        strong_hits = set()
+        for match in self._strong_re.finditer(question):
+            strong_hits.add(match.lastgroup)
+            if len(strong_hits) > 1:
+                break
+        if len(strong_hits) == 1:
+            return self._strong_types[strong_hits.pop()]
+
+        # Sinon : score de tous les types et argmax
+        scores = {q_type: len(regex.findall(question)) for q_type, regex in self._type_re.items()}
 
         # Retourner le type avec le score le plus élevé
         if max(scores.values()) > 0:
@@ -126,21 +169,31 @@ class QuestionClassifier:
 
         return QuestionType.UNKNOWN
 
-    def _calculate_confidence(self, question: str, question_type: QuestionType) -> float:
+    def _scan_keywords(self, question: str) -> Dict[str, Set[str]]:
+        """Regroupe par catégorie les mots-clés présents dans la question"""
+        hits = {"css": set(), "simple": set()}
+        for _, (category, word) in self._keyword_automaton.iter(question):
+            hits[category].add(word)
+        return hits
+
+    def _calculate_confidence(self, question: str, question_type: QuestionType,
+                              keyword_hits: Optional[Dict[str, Set[str]]] = None) -> float:
         """Calcule la confiance de la classification"""
         if question_type == QuestionType.UNKNOWN:
             return 0.1
 
+        if keyword_hits is None:
+            keyword_hits = self._scan_keywords(question)
+
         # Facteurs de confiance
         confidence = 0.5  # Base
 
         # Présence de mots-clés CSS
-        css_keywords_found = sum(1 for keyword in self.css_keywords if keyword in question)
+        css_keywords_found = len(keyword_hits["css"])
         confidence += min(css_keywords_found * 0.1, 0.3)
 
         # Questions simples
-        simple_indicators = sum(1 for indicator in self.simple_question_indicators if indicator in question)
-        if simple_indicators > 0:
+        if keyword_hits["simple"]:
             confidence += 0.2
 
         # Longueur de la question (questions courtes souvent plus simples)
@@ -149,22 +202,21 @@ class QuestionClassifier:
 
         return min(confidence, 1.0)
 
-    def _extract_keywords(self, question: str) -> List[str]:
+    def _extract_keywords(self, question: str,
+                          keyword_hits: Optional[Dict[str, Set[str]]] = None) -> List[str]:
         """Extrait les mots-clés pertinents de la question"""
-        keywords = []
+        if keyword_hits is None:
+            keyword_hits = self._scan_keywords(question)
 
         # Mots-clés CSS trouvés
-        for keyword in self.css_keywords:
-            if keyword in question:
-                keywords.append(keyword)
+        keywords = list(keyword_hits["css"])
 
         # Mots-clés numériques (âges, montants, etc.)
-        numbers = re.findall(r'\b\d+\b', question)
+        numbers = self._num_re.findall(question)
         keywords.extend(numbers)
 
         # Mots importants (noms, verbes d'action)
-        important_words = re.findall(r'\b(retraite|pension|allocation|cotisation|prestation|dossier|demande)\b',
-                                     question)
+        important_words = self._important_re.findall(question)
         keywords.extend(important_words)
 
         return list(set(keywords))  # Supprimer les doublons
@@ -199,7 +251,7 @@ class QuestionClassifier:
             question_type == QuestionType.DEFINITION and confidence > 0.7,
 
             # Questions avec mots-clés CSS spécifiques
-            len(keywords) >= 2 and any(kw in ["âge", "retraite", "montant"] for kw in keywords)
+            len(keywords) >= 2 and not self._skip_kw.isdisjoint(keywords)
         ]
 
         return any(skip_conditions)
@@ -210,5 +262,6 @@ class QuestionClassifier:
             "total_patterns": sum(len(patterns) for patterns in self.patterns.values()),
             "question_types": len(QuestionType),
             "css_keywords": len(self.css_keywords),
-            "simple_indicators": len(self.simple_question_indicators)
+            "simple_indicators": len(self.simple_question_indicators),
+            "classification_cache": self._classify_cached.cache_info()._asdict()
         }
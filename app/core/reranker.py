@@ -1,10 +1,44 @@
+import os
+import heapq
+import threading
+from collections import OrderedDict
+import numpy as np
+import torch
+import xxhash
 from sentence_transformers import CrossEncoder
+from transformers import AutoTokenizer
 from typing import List
 from dataclasses import dataclass
 
 from app.core.cache import cache
+from app.core.config import settings
 from app.utils.logging import logger
 
+# Runtime ONNX (optionnel) pour le cross-encoder quantifié int8
+try:
+    import onnxruntime
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+
+# Nombre de scores cross-encoder (requête, chunk) conservés en mémoire
+PAIR_CACHE_SIZE = 10_000
+
+# Cross-encoder chargé par le maître Gunicorn avant le fork (voir gunicorn.conf.py)
+_preloaded_model = None
+
+
+def preload_model():
+    """Charge le cross-encoder PyTorch CPU pour le partager entre workers forkés"""
+    global _preloaded_model
+    # CUDA et onnxruntime (pool de threads) ne supportent pas un fork après initialisation
+    if torch.cuda.is_available() or (ONNXRUNTIME_AVAILABLE and os.path.isdir(settings.RERANKER_ONNX_PATH)):
+        return
+    if _preloaded_model is None:
+        _preloaded_model = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-12-v2', device="cpu", max_length=512)
+        logger.info("Cross-encoder pré-chargé avant fork des workers")
+
 
 @dataclass
 class RankedResult:
@@ -14,64 +48,163 @@ class RankedResult:
     original_rank: int
 
 
+class OnnxCrossEncoder:
+    """Cross-encoder exporté en ONNX int8, même interface predict que CrossEncoder"""
+
+    def __init__(self, model_dir: str, max_length: int = 512):
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+
+        providers = ["CPUExecutionProvider"]
+        if "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+
+        model_file = next(name for name in os.listdir(model_dir) if name.endswith(".onnx"))
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, model_file), providers=providers)
+        self.input_names = {inp.name for inp in self.session.get_inputs()}
+
+    def predict(self, pairs, batch_size: int = 32, **kwargs) -> np.ndarray:
+        """Scores de pertinence (sigmoïde des logits, comme CrossEncoder à un label)"""
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            features = self.tokenizer(
+                [query for query, _ in batch], [doc for _, doc in batch],
+                padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+            )
+            inputs = {name: value.astype(np.int64) for name, value in features.items() if name in self.input_names}
+            logits = self.session.run(None, inputs)[0]
+            scores.append(logits[:, 0])
+
+        logits = np.concatenate(scores) if scores else np.empty(0, dtype=np.float32)
+        return 1 / (1 + np.exp(-logits))
+
+
 # Re-ranking avancé
 class AdvancedReranker:
     def __init__(self):
-        # Modèle de re-ranking haute performance
-        self.reranker = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-12-v2')
-        self.rerank_cache = {}
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # Cross-encoder chargé au premier re-ranking (démarrage plus rapide)
+        self._reranker = None
+        self._init_lock = threading.Lock()
+        # Cache LRU des scores cross-encoder par paire (hash requête, hash chunk) : les
+        # reformulations proches qui retrouvent les mêmes chunks ne repassent pas par le modèle
+        self.rerank_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _get_model(self):
+        """Retourne le cross-encoder, chargé une seule fois même en accès concurrent"""
+        if self._reranker is None:
+            with self._init_lock:
+                if self._reranker is None:
+                    self._reranker = self._load_model()
+        return self._reranker
+
+    def _load_model(self):
+        """Chargement du cross-encoder : ONNX int8 si exporté, sinon PyTorch"""
+        if _preloaded_model is not None:
+            return _preloaded_model
+
+        if ONNXRUNTIME_AVAILABLE and os.path.isdir(settings.RERANKER_ONNX_PATH):
+            try:
+                model = OnnxCrossEncoder(settings.RERANKER_ONNX_PATH, max_length=512)
+                logger.info(f"Cross-encoder ONNX int8 chargé depuis {settings.RERANKER_ONNX_PATH}")
+                return model
+            except Exception as e:
+                logger.warning(f"Cross-encoder ONNX indisponible, repli PyTorch: {e}")
+
+        # Modèle de re-ranking haute performance (FP16 sur GPU)
+        model = CrossEncoder(
+            'cross-encoder/ms-marco-MiniLM-L-12-v2', device=self.device, max_length=512
+        )
+        if self.device == "cuda":
+            model.model.half()
+        return model
+
+    def _cross_scores(self, query: str, results: List) -> np.ndarray:
+        """Scores cross-encoder des paires (requête, chunk), servis par le cache quand possible"""
+        query_hash = xxhash.xxh3_64_intdigest(query.encode())
+        pair_keys = [(query_hash, xxhash.xxh3_64_intdigest(r.content.encode())) for r in results]
+
+        cross_scores = np.empty(len(results), dtype=np.float64)
+        missing = []
+        with self._cache_lock:
+            for i, key in enumerate(pair_keys):
+                score = self.rerank_cache.get(key)
+                if score is None:
+                    missing.append(i)
+                else:
+                    cross_scores[i] = score
+                    self.rerank_cache.move_to_end(key)
+
+        if missing:
+            pairs = [(query, results[i].content) for i in missing]
+            predicted = self._get_model().predict(
+                pairs, batch_size=max(8, len(pairs)), convert_to_numpy=True, show_progress_bar=False
+            )
+            cross_scores[missing] = predicted
+            with self._cache_lock:
+                for i, score in zip(missing, cross_scores[missing].tolist()):
+                    self.rerank_cache[pair_keys[i]] = score
+                while len(self.rerank_cache) > PAIR_CACHE_SIZE:
+                    self.rerank_cache.popitem(last=False)
+
+        return cross_scores
 
     def rerank(self, query: str, results: List, top_k: int = 5) -> List[RankedResult]:
         """Re-ranking des résultats avec cross-encoder"""
         if not results:
             return []
 
-        # Vérification du cache
-        cache_key = f"{query}_{len(results)}_{hash(tuple(r.content[:50] for r in results))}"
+        # Vérification du cache (clé stable entre processus : xxh3 sur les contenus complets)
+        cache_key = xxhash.xxh3_64_hexdigest(
+            "\x00".join([query, str(top_k)] + [r.content for r in results]).encode()
+        )
         cached = cache.get(cache_key, "rerank")
         if cached:
-            return cached[:top_k]
+            return cached
 
         try:
-            # Préparation des paires query-document
-            pairs = [(query, result.content) for result in results]
-
-            # Scoring avec cross-encoder
-            cross_scores = self.reranker.predict(pairs)
+            # Scoring avec cross-encoder (seules les paires absentes du cache)
+            cross_scores = self._cross_scores(query, results)
 
-            # Combinaison des scores (retrieval + reranking)
-            final_results = []
-            for i, (result, cross_score) in enumerate(zip(results, cross_scores)):
-                # Score final: pondération retrieval (30%) + cross-encoder (70%)
-                final_score = 0.3 * result.score + 0.7 * cross_score
+            # Score final vectorisé: pondération retrieval (30%) + cross-encoder (70%)
+            original_scores = np.fromiter((r.score for r in results), dtype=np.float64, count=len(results))
+            final_scores = 0.3 * original_scores + 0.7 * cross_scores
 
-                final_results.append(RankedResult(
-                    content=result.content,
-                    score=final_score,
-                    metadata=result.metadata,
-                    original_rank=i
-                ))
-
-            # Tri par score final
-            ranked_results = sorted(final_results, key=lambda x: x.score, reverse=True)
+            # Sélection des top_k sans trier l'ensemble, puis tri des seuls retenus
+            k = min(top_k, len(results))
+            if k > 0:
+                top_indices = np.argpartition(-final_scores, k - 1)[:k]
+                top_indices = top_indices[np.argsort(-final_scores[top_indices], kind="stable")]
+            else:
+                top_indices = []
 
-            # Cache du résultat
-            cache.set(cache_key, ranked_results, ttl=1800, cache_type="rerank")
+            # Cache du résultat (uniquement les top_k conservés)
+            top_results = [
+                RankedResult(
+                    content=results[i].content,
+                    score=float(final_scores[i]),
+                    metadata=results[i].metadata,
+                    original_rank=int(i)
+                )
+                for i in top_indices
+            ]
+            cache.set(cache_key, top_results, ttl=1800, cache_type="rerank")
 
-            return ranked_results[:top_k]
+            return top_results
 
         except Exception as e:
-            # Import local pour éviter les problèmes de portée
-            from app.utils.logging import logger
             logger.error(f"Erreur re-ranking: {e}")
-            # Fallback: retour des résultats originaux
-            fallback_results = [
+            # Fallback: retour des meilleurs résultats originaux (les variantes de requête
+            # sont concaténées, l'entrée n'est donc pas globalement triée)
+            best = heapq.nlargest(top_k, enumerate(results), key=lambda item: item[1].score)
+            return [
                 RankedResult(
                     content=result.content,
                     score=result.score,
                     metadata=result.metadata,
                     original_rank=i
                 )
-                for i, result in enumerate(results)
+                for i, result in best
             ]
-            return sorted(fallback_results, key=lambda x: x.score, reverse=True)[:top_k]
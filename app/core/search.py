@@ -1,7 +1,14 @@
+import os
+import re
+import copy
+import asyncio
+import threading
+import pickle
+import tempfile
 import numpy as np
+import xxhash
 from rank_bm25 import BM25Okapi
-from typing import List, Optional
-import hashlib
+from typing import Iterable, List, Optional
 from dataclasses import dataclass
 
 from app.utils.logging import logger
@@ -15,102 +22,431 @@ class SearchResult:
     source_type: str  # "dense", "sparse", "hybrid"
 
 
+# Version du format de l'index BM25 persisté (à incrémenter si la tokenisation change)
+_BM25_INDEX_VERSION = 2
+
+# Tokenisation BM25 : mots alphanumériques, ponctuation exclue ("l'âge," -> ["l", "âge"])
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _tokenize(text: str) -> List[str]:
+    """Tokenisation en minuscules pour BM25"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+@dataclass(frozen=True)
+class _BM25Snapshot:
+    """État complet de l'index BM25, jamais modifié après publication"""
+    bm25: BM25Okapi
+    documents: List[str]
+    document_ids: List[str]
+    # Index inversé BM25 (CSR) : postings triés par terme
+    vocab: dict
+    idf: np.ndarray
+    postings_indptr: np.ndarray
+    postings_docs: np.ndarray
+    postings_weights: np.ndarray
+    # Postings à plat (non triés) conservés pour les mises à jour incrémentales
+    flat_terms: np.ndarray
+    flat_docs: np.ndarray
+    flat_tf: np.ndarray
+    df: np.ndarray
+    total_len: int
+
+
+def _finalize_snapshot(bm25: BM25Okapi, documents: List[str], document_ids: List[str], vocab: dict,
+                       idf: np.ndarray, flat_terms: np.ndarray, flat_docs: np.ndarray,
+                       flat_tf: np.ndarray, df: np.ndarray, total_len: int) -> _BM25Snapshot:
+    """Trie les postings à plat par terme (CSR) et calcule leurs poids BM25"""
+    order = np.argsort(flat_terms, kind="stable")
+    docs = flat_docs[order]
+    tf = flat_tf[order]
+
+    indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(flat_terms, minlength=len(vocab)), out=indptr[1:])
+
+    # Partie du score BM25 indépendante de la requête (même formule que BM25Okapi.get_scores)
+    doc_len = np.asarray(bm25.doc_len, dtype=np.float64)[docs]
+    weights = tf * (bm25.k1 + 1) / (tf + bm25.k1 * (1 - bm25.b + bm25.b * doc_len / bm25.avgdl))
+
+    return _BM25Snapshot(
+        bm25=bm25, documents=documents, document_ids=document_ids, vocab=vocab, idf=idf,
+        postings_indptr=indptr, postings_docs=docs, postings_weights=weights,
+        flat_terms=flat_terms, flat_docs=flat_docs, flat_tf=flat_tf, df=df, total_len=total_len
+    )
+
+
+def _build_snapshot(bm25: BM25Okapi, documents: List[str], document_ids: List[str]) -> _BM25Snapshot:
+    """Aplatit les fréquences BM25 en index inversé CSR avec poids précalculés"""
+    vocab = {}
+    term_ids, doc_ids, tfs = [], [], []
+    for doc_idx, freqs in enumerate(bm25.doc_freqs):
+        for term, tf in freqs.items():
+            term_ids.append(vocab.setdefault(term, len(vocab)))
+            doc_ids.append(doc_idx)
+            tfs.append(tf)
+
+    flat_terms = np.asarray(term_ids, dtype=np.int64)
+    idf = np.array([bm25.idf.get(term) or 0 for term in vocab], dtype=np.float64)
+    return _finalize_snapshot(
+        bm25, documents, document_ids, vocab, idf,
+        flat_terms, np.asarray(doc_ids, dtype=np.int64), np.asarray(tfs, dtype=np.float64),
+        np.bincount(flat_terms, minlength=len(vocab)), int(sum(bm25.doc_len))
+    )
+
+
 # Recherche hybride Dense + Sparse
 class HybridSearch:
-    def __init__(self, chroma_db, embeddings_model):
+    def __init__(self, chroma_db, embeddings_model, index_path: Optional[str] = None):
         self.chroma_db = chroma_db
         self.embeddings = embeddings_model
-        self.bm25_index = None
-        self.documents = []
-        self.document_ids = []
-        self._build_bm25_index()
+        self.index_path = index_path
+
+        # Index BM25 publié par une seule affectation : les recherches (threads) lisent
+        # self._index une fois et travaillent sur un état cohérent, sans verrou
+        self._index: Optional[_BM25Snapshot] = None
+        # Sérialise les écritures (mises à jour incrémentales et reconstructions)
+        self._index_lock = threading.Lock()
+
+        with self._index_lock:
+            self._build_bm25_index()
+
+    @property
+    def bm25_index(self) -> Optional[BM25Okapi]:
+        index = self._index
+        return index.bm25 if index else None
+
+    @property
+    def documents(self) -> List[str]:
+        index = self._index
+        return index.documents if index else []
+
+    @property
+    def document_ids(self) -> List[str]:
+        index = self._index
+        return index.document_ids if index else []
+
+    def _load_bm25_index(self) -> Optional[_BM25Snapshot]:
+        """Chargement de l'index BM25 persisté s'il correspond encore à la collection"""
+        if not self.index_path or not os.path.exists(self.index_path):
+            return None
+
+        try:
+            with open(self.index_path, "rb") as f:
+                data = pickle.load(f)
+
+            if data.get("version") != _BM25_INDEX_VERSION:
+                return None
+
+            # La collection n'a pas changé si elle contient exactement les mêmes ids
+            current_ids = self.chroma_db.get(include=[])["ids"]
+            if len(current_ids) != len(data["ids"]) or set(current_ids) != set(data["ids"]):
+                return None
+
+            index = _build_snapshot(data["bm25"], data["docs"], data["ids"])
+            logger.info(f"Index BM25 chargé depuis {self.index_path} ({len(index.documents)} documents)")
+            return index
+        except Exception as e:
+            logger.warning(f"Index BM25 persisté inutilisable, reconstruction: {e}")
+            return None
+
+    def _save_bm25_index(self, index: Optional[_BM25Snapshot]):
+        """Sauvegarde atomique de l'index BM25 sur disque"""
+        if not self.index_path:
+            return
+
+        tmp_path = None
+        try:
+            index_dir = os.path.dirname(self.index_path) or "."
+            os.makedirs(index_dir, exist_ok=True)
+            # Fichier temporaire propre à chaque écriture : les workers Gunicorn qui sauvegardent
+            # en même temps ne tronquent pas le fichier d'un autre avant os.replace
+            fd, tmp_path = tempfile.mkstemp(dir=index_dir, prefix=f"{os.path.basename(self.index_path)}.", suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump({
+                    "version": _BM25_INDEX_VERSION,
+                    "docs": index.documents if index else [],
+                    "ids": index.document_ids if index else [],
+                    "bm25": index.bm25 if index else None,
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            logger.warning(f"Erreur sauvegarde index BM25: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
     def _build_bm25_index(self):
-        """Construction de l'index BM25"""
+        """Construction de l'index BM25 (appelant détenteur de _index_lock)"""
+        index = self._load_bm25_index()
+        if index is not None:
+            self._index = index
+            return
+
         try:
             # Récupération de tous les documents
             results = self.chroma_db.get()
             if results and results.get("documents"):
-                self.documents = results["documents"]
-                self.document_ids = results["ids"]
+                documents = results["documents"]
+                document_ids = results["ids"]
 
                 # Tokenisation pour BM25
-                tokenized_docs = [doc.lower().split() for doc in self.documents]
-                self.bm25_index = BM25Okapi(tokenized_docs)
+                tokenized_docs = [_tokenize(doc) for doc in documents]
+                index = _build_snapshot(BM25Okapi(tokenized_docs), documents, document_ids)
+                self._index = index
+                self._save_bm25_index(index)
 
-                logger.info(f"Index BM25 construit avec {len(self.documents)} documents")
+                logger.info(f"Index BM25 construit avec {len(documents)} documents")
         except Exception as e:
             logger.error(f"Erreur construction index BM25: {e}")
 
+    def add_to_index(self, chunks_data: List[dict], removed_ids: Iterable[str] = ()):
+        """
+        Mise à jour incrémentale de l'index BM25 : retire les chunks supprimés et ajoute
+        les nouveaux sans re-tokeniser ni relire le corpus existant
+        """
+        with self._index_lock:
+            try:
+                self._update_index(chunks_data, removed_ids)
+            except Exception as e:
+                logger.error(f"Erreur mise à jour incrémentale BM25, reconstruction complète: {e}")
+                self._rebuild_index()
+
+    def _update_index(self, chunks_data: List[dict], removed_ids: Iterable[str]):
+        """Construit le nouvel état en variables locales puis le publie (appelant détenteur de _index_lock)"""
+        index = self._index
+        if index is None:
+            self._build_bm25_index()
+            return
+
+        bm25 = index.bm25
+        new_docs = [chunk["content"] for chunk in chunks_data]
+        new_ids = [chunk["metadata"]["chunk_id"] for chunk in chunks_data]
+
+        # 1. Retrait des chunks remplacés ou supprimés
+        stale = set(removed_ids)
+        stale.update(new_ids)
+        keep = np.fromiter((doc_id not in stale for doc_id in index.document_ids),
+                           dtype=bool, count=len(index.document_ids))
+        documents, document_ids = index.documents, index.document_ids
+        doc_freqs, doc_len = bm25.doc_freqs, bm25.doc_len
+        flat_terms, flat_docs, flat_tf = index.flat_terms, index.flat_docs, index.flat_tf
+        df, total_len = index.df.copy(), index.total_len
+        if not keep.all():
+            kept = np.flatnonzero(keep).tolist()
+            documents = [documents[i] for i in kept]
+            document_ids = [document_ids[i] for i in kept]
+            doc_freqs = [doc_freqs[i] for i in kept]
+            doc_len = [doc_len[i] for i in kept]
+            total_len = sum(doc_len)
+
+            kept_postings = keep[flat_docs]
+            df -= np.bincount(flat_terms[~kept_postings], minlength=len(df))
+            new_index = np.cumsum(keep) - 1
+            flat_terms = flat_terms[kept_postings]
+            flat_docs = new_index[flat_docs[kept_postings]]
+            flat_tf = flat_tf[kept_postings]
+        else:
+            documents, document_ids = list(documents), list(document_ids)
+            doc_freqs, doc_len = list(doc_freqs), list(doc_len)
+
+        # 2. Ajout des nouveaux chunks (seuls ceux-ci sont tokenisés)
+        vocab = dict(index.vocab)
+        add_terms, add_docs, add_tfs = [], [], []
+        for doc in new_docs:
+            tokens = _tokenize(doc)
+            freqs = {}
+            for token in tokens:
+                freqs[token] = freqs.get(token, 0) + 1
+            doc_idx = len(doc_freqs)
+            doc_freqs.append(freqs)
+            doc_len.append(len(tokens))
+            total_len += len(tokens)
+            for term, tf in freqs.items():
+                add_terms.append(vocab.setdefault(term, len(vocab)))
+                add_docs.append(doc_idx)
+                add_tfs.append(tf)
+        documents.extend(new_docs)
+        document_ids.extend(new_ids)
+
+        if not doc_freqs:
+            self._index = None
+            self._save_bm25_index(None)
+            return
+
+        add_terms = np.asarray(add_terms, dtype=np.int64)
+        df = np.concatenate([df, np.zeros(len(vocab) - len(df), dtype=df.dtype)])
+        df += np.bincount(add_terms, minlength=len(vocab))
+        flat_terms = np.concatenate([flat_terms, add_terms])
+        flat_docs = np.concatenate([flat_docs, np.asarray(add_docs, dtype=np.int64)])
+        flat_tf = np.concatenate([flat_tf, np.asarray(add_tfs, dtype=np.float64)])
+
+        # 3. Statistiques du corpus : longueur moyenne par somme courante,
+        # IDF vectorisé sur le vocabulaire (même formule et plancher que BM25Okapi._calc_idf)
+        corpus_size = len(doc_freqs)
+        present = df > 0
+        idf = np.zeros(len(vocab), dtype=np.float64)
+        idf[present] = np.log(corpus_size - df[present] + 0.5) - np.log(df[present] + 0.5)
+        average_idf = idf[present].mean()
+        idf[present & (idf < 0)] = bm25.epsilon * average_idf
+
+        # Nouvel objet BM25Okapi : l'ancien reste intact pour les recherches en cours
+        new_bm25 = copy.copy(bm25)
+        new_bm25.doc_freqs = doc_freqs
+        new_bm25.doc_len = doc_len
+        new_bm25.corpus_size = corpus_size
+        new_bm25.avgdl = total_len / corpus_size
+        new_bm25.average_idf = average_idf
+        idf_values = idf.tolist()
+        new_bm25.idf = {term: idf_values[i] for term, i in vocab.items() if present[i]}
+
+        # 4. Publication atomique du nouvel état
+        index = _finalize_snapshot(
+            new_bm25, documents, document_ids, vocab, idf, flat_terms, flat_docs, flat_tf, df, total_len
+        )
+        self._index = index
+        self._save_bm25_index(index)
+
+        logger.info(f"Index BM25 mis à jour: +{len(new_ids)} chunks, {len(documents)} documents")
+
+    @staticmethod
+    def _bm25_scores(index: _BM25Snapshot, query_tokens: List[str]) -> np.ndarray:
+        """Scores BM25 de tous les documents en ne parcourant que les postings des termes de la requête"""
+        scores = np.zeros(len(index.documents))
+        indptr, docs, weights, idf = index.postings_indptr, index.postings_docs, index.postings_weights, index.idf
+        for token in query_tokens:
+            term = index.vocab.get(token)
+            if term is None:
+                continue
+            start, end = indptr[term], indptr[term + 1]
+            scores[docs[start:end]] += idf[term] * weights[start:end]
+        return scores
+
+    def _rebuild_index(self):
+        """Reconstruction complète (appelant détenteur de _index_lock)"""
+        if self.index_path and os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        self._index = None
+        self._build_bm25_index()
+
     def rebuild_index(self):
         """Reconstruction de l'index BM25"""
-        self._build_bm25_index()
+        with self._index_lock:
+            self._rebuild_index()
 
     async def search(self, query: str, n_results: int = 10, alpha: float = 0.7) -> List[SearchResult]:
         """Recherche hybride avec pondération dense/sparse"""
-        results = []
+        # Recherches dense (I/O ChromaDB) et sparse (calcul BM25) indépendantes : exécution concurrente
+        # Tokenisation unique de la requête pour la branche BM25
+        query_tokens = _tokenize(query)
+
+        loop = asyncio.get_running_loop()
+        dense_results, sparse_results = await asyncio.gather(
+            loop.run_in_executor(None, self._dense_search, query, n_results, alpha),
+            loop.run_in_executor(None, self._sparse_search, query_tokens, n_results, alpha)
+        )
+
+        # Combinaison et déduplication
+        return self._combine_and_deduplicate(dense_results + sparse_results, n_results)
+
+    async def search_with_embedding(self, query: str, query_embedding: np.ndarray,
+                                    n_results: int = 10, alpha: float = 0.7) -> List[SearchResult]:
+        """Recherche hybride avec un embedding de requête déjà calculé (pas de ré-encodage)"""
+        query_tokens = _tokenize(query)
 
-        # 1. Recherche dense (vectorielle)
+        loop = asyncio.get_running_loop()
+        dense_results, sparse_results = await asyncio.gather(
+            loop.run_in_executor(None, self._dense_search, query, n_results, alpha, query_embedding),
+            loop.run_in_executor(None, self._sparse_search, query_tokens, n_results, alpha)
+        )
+
+        return self._combine_and_deduplicate(dense_results + sparse_results, n_results)
+
+    def _dense_search(self, query: str, n_results: int, alpha: float,
+                      query_embedding: Optional[np.ndarray] = None) -> List[SearchResult]:
+        """Recherche dense (vectorielle), à partir de l'embedding fourni s'il existe"""
+        results = []
         try:
+            if query_embedding is None:
+                # Embedding de requête mémoïsé : les reformulations répétées ne repassent pas par le modèle
+                query_embedding = self.embeddings.embed_query(query)
+            # Matrice float32 1xD contiguë (vue sans copie si déjà float32), pas de liste Python
             dense_results = self.chroma_db.query(
-                query_texts=[query],
+                query_embeddings=np.ascontiguousarray(query_embedding, dtype=np.float32)[np.newaxis],
                 n_results=min(n_results * 2, 20)
             )
 
             if dense_results and dense_results.get("documents") and dense_results["documents"][0]:
-                for i, (doc, distance) in enumerate(zip(
-                        dense_results["documents"][0],
-                        dense_results["distances"][0]
-                )):
-                    # Conversion distance en score
-                    dense_score = 1 / (1 + distance)
-
-                    metadata = dense_results["metadatas"][0][i] if dense_results.get("metadatas") else {}
+                # Colonnes extraites une seule fois, parcours par index (pas de recherche par ligne)
+                docs = dense_results["documents"][0]
+                metas = dense_results["metadatas"][0] if dense_results.get("metadatas") else None
+                chunk_ids = dense_results["ids"][0] if dense_results.get("ids") else None
+                # Conversion distance -> score pondéré en une opération vectorisée sur tout le lot
+                distances = np.asarray(dense_results["distances"][0], dtype=np.float64)
+                dense_scores = (alpha / (1 + distances)).tolist()
+                for i in range(len(docs)):
+                    metadata = (metas[i] if metas else None) or {}
+                    if chunk_ids:
+                        # Identifiant ChromaDB du chunk : clé de déduplication
+                        metadata.setdefault("chunk_id", chunk_ids[i])
 
                     results.append(SearchResult(
-                        content=doc,
-                        score=dense_score * alpha,
+                        content=docs[i],
+                        score=dense_scores[i],
                         metadata=metadata,
                         source_type="dense"
                     ))
         except Exception as e:
             logger.error(f"Erreur recherche dense: {e}")
 
-        # 2. Recherche sparse (BM25)
-        if self.bm25_index and self.documents:
+        return results
+
+    def _sparse_search(self, query_tokens: List[str], n_results: int, alpha: float) -> List[SearchResult]:
+        """Recherche sparse (BM25) à partir de la requête déjà tokenisée"""
+        results = []
+        # Lecture unique de l'index : scores, contenus et ids issus du même état
+        index = self._index
+        if index and index.documents and query_tokens:
             try:
-                query_tokens = query.lower().split()
-                bm25_scores = self.bm25_index.get_scores(query_tokens)
+                bm25_scores = self._bm25_scores(index, query_tokens)
 
-                # Top résultats BM25
-                top_indices = np.argsort(bm25_scores)[::-1][:n_results]
+                # Top résultats BM25 : sélection O(N) puis tri des k meilleurs uniquement
+                k = min(n_results, len(bm25_scores))
+                if k > 0:
+                    candidates = np.argpartition(bm25_scores, -k)[-k:]
+                    top_indices = candidates[np.argsort(bm25_scores[candidates])[::-1]]
+                    top_indices = top_indices[bm25_scores[top_indices] > 0]
+                else:
+                    top_indices = []
 
                 for idx in top_indices:
-                    if bm25_scores[idx] > 0:
-                        sparse_score = bm25_scores[idx] * (1 - alpha)
-
-                        results.append(SearchResult(
-                            content=self.documents[idx],
-                            score=sparse_score,
-                            metadata={"document_id": self.document_ids[idx] if idx < len(
-                                self.document_ids) else f"doc_{idx}"},
-                            source_type="sparse"
-                        ))
+                    sparse_score = bm25_scores[idx] * (1 - alpha)
+                    chunk_id = index.document_ids[idx] if idx < len(index.document_ids) else None
+
+                    results.append(SearchResult(
+                        content=index.documents[idx],
+                        score=sparse_score,
+                        metadata={"document_id": chunk_id or f"doc_{idx}", "chunk_id": chunk_id},
+                        source_type="sparse"
+                    ))
             except Exception as e:
                 logger.error(f"Erreur recherche BM25: {e}")
 
-        # 3. Combinaison et déduplication
-        return self._combine_and_deduplicate(results, n_results)
+        return results
 
     def _combine_and_deduplicate(self, results: List[SearchResult], n_results: int) -> List[SearchResult]:
         """Combinaison et déduplication des résultats"""
-        # Groupement par contenu similaire
-        unique_results = {}
-        for result in results:
-            content_hash = hashlib.md5(result.content.encode()).hexdigest()[:16]
-            if content_hash not in unique_results or result.score > unique_results[content_hash].score:
-                unique_results[content_hash] = result
-
-        # Tri par score et limitation
-        final_results = sorted(unique_results.values(), key=lambda x: x.score, reverse=True)
-        return final_results[:n_results]
+        return deduplicate_results(results, n_results)
+
+
+def deduplicate_results(results: List[SearchResult], n_results: int) -> List[SearchResult]:
+    """Un résultat par chunk (meilleur score), triés par score et limités à n_results"""
+    # Groupement par chunk ChromaDB (hash du contenu si l'identifiant est absent)
+    unique_results = {}
+    for result in results:
+        key = result.metadata.get("chunk_id") or xxhash.xxh3_64_intdigest(result.content.encode())
+        if key not in unique_results or result.score > unique_results[key].score:
+            unique_results[key] = result
+
+    # Tri par score et limitation
+    final_results = sorted(unique_results.values(), key=lambda x: x.score, reverse=True)
+    return final_results[:n_results]
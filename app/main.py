@@ -8,7 +8,7 @@ from app.core.config import settings
 from app.utils.logging import setup_logging
 from app.services.rag_service import multimodal_rag_system
 from app.core.search import SearchResult
-from app.middleware.metrics_middleware import MetricsMiddleware, RAGMetricsMiddleware, CacheMetricsMiddleware
+from app.middleware.metrics_middleware import UnifiedMetricsMiddleware
 from app.core.metrics import metrics_collector
 from app.core.business_metrics import business_metrics_collector
 
@@ -29,25 +29,27 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
-# Ajout des middlewares de métriques
-app.add_middleware(MetricsMiddleware)
-app.add_middleware(RAGMetricsMiddleware)
-app.add_middleware(CacheMetricsMiddleware)
+# Ajout du middleware de métriques (API, RAG et cache en une seule passe)
+app.add_middleware(UnifiedMetricsMiddleware)
 
 # Inclusion des routeurs
 app.include_router(router)
 app.include_router(dashboard_router)
 
 
+# Tâche asyncio du bot Telegram (exécuté dans le processus de l'API)
+_telegram_task = None
+
+
 @app.on_event("startup")
 async def startup_event():
     """Événements de démarrage pour optimisation"""
+    import asyncio
     import threading
-    import subprocess
-    import sys
-    from pathlib import Path
     from app.utils.logging import logger
 
+    global _telegram_task
+
     logger.info("Démarrage du RAG Ultra Performant Multimodal...")
 
     def preload_reranker():
@@ -60,21 +62,14 @@ async def startup_event():
             logger.warning(f"Erreur pré-chargement reranker: {e}")
 
     def start_telegram_bot():
-        """Démarre le bot Telegram automatiquement"""
+        """Démarre le bot Telegram automatiquement (tâche asyncio, sans processus séparé)"""
         try:
             # Vérifier si le bot doit être démarré automatiquement
             auto_start_bot = os.getenv('AUTO_START_TELEGRAM_BOT', 'false').lower() == 'true'
             
             if not auto_start_bot:
                 logger.info("Démarrage automatique du bot Telegram désactivé")
-                return
-                
-            # Chemin vers le script du bot avancé
-            bot_script = Path(__file__).parent.parent / "telegram_advanced.py"
-            
-            if not bot_script.exists():
-                logger.warning(f"Script du bot Telegram non trouvé: {bot_script}")
-                return
+                return None
                 
             # Vérifier les variables d'environnement nécessaires
             telegram_token = os.getenv('TELEGRAM_TOKEN')
@@ -82,32 +77,57 @@ async def startup_event():
             
             if not telegram_token:
                 logger.warning("TELEGRAM_TOKEN non défini - bot Telegram non démarré")
-                return
+                return None
+
+            # Module du bot avancé (telegram_advanced.py à la racine du projet)
+            try:
+                import telegram_advanced
+            except (ImportError, SystemExit) as e:
+                logger.warning(f"Bot Telegram indisponible: {e}")
+                return None
                 
             logger.info("🤖 Démarrage automatique du bot Telegram avancé...")
-            
-            # Définir les variables d'environnement pour le bot
-            env = os.environ.copy()
-            env['TELEGRAM_TOKEN'] = telegram_token
-            env['CSS_API_URL'] = css_api_url
-            
-            # Démarrer le bot avancé en arrière-plan
-            bot_cwd = Path(__file__).parent.parent
-            subprocess.Popen(
-                [sys.executable, str(bot_script)],
-                cwd=str(bot_cwd),
-                env=env,
-                start_new_session=True
-            )
-            
+            task = asyncio.create_task(telegram_advanced.run_bot(telegram_token, css_api_url))
             logger.info("✅ Bot Telegram démarré automatiquement")
+            return task
             
         except Exception as e:
             logger.error(f"Erreur lors du démarrage automatique du bot Telegram: {e}")
+            return None
+
+    # Démarrage des tâches en arrière-plan (pré-chargement du reranker sur demande uniquement)
+    if os.getenv('WARM_RERANKER', 'false').lower() in ('1', 'true'):
+        threading.Thread(target=preload_reranker, daemon=True).start()
+    _telegram_task = start_telegram_bot()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Arrêt propre du bot Telegram (arrêt du polling et de l'application), du pool de parsing, du client HTTP des health checks et du logger CSV"""
+    import asyncio
+    from app.utils.logging import logger
+
+    if _telegram_task and not _telegram_task.done():
+        _telegram_task.cancel()
+        try:
+            await _telegram_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"Erreur arrêt du bot Telegram: {e}")
+
+    from app.services.document_service import shutdown_document_pool
+    shutdown_document_pool()
+
+    from app.core.health_check import health_checker
+    await health_checker.close()
 
-    # Démarrage des tâches en arrière-plan
-    threading.Thread(target=preload_reranker, daemon=True).start()
-    threading.Thread(target=start_telegram_bot, daemon=True).start()
+    # Écriture du dernier lot de lignes CSV en attente
+    from app.services.csv_logger import csv_logger
+    try:
+        await csv_logger.stop()
+    except Exception as e:
+        logger.warning(f"Erreur arrêt du logger CSV: {e}")
 
 
 if __name__ == "__main__":
@@ -1,205 +1,115 @@
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import re
+import sys
 import time
 import logging
-from typing import Callable
 from app.core.metrics import metrics_collector
 
 logger = logging.getLogger(__name__)
 
-class MetricsMiddleware(BaseHTTPMiddleware):
+# Segments d'URL variables (UUID, hash, entier) regroupés quand aucune route ne correspond
+_ID_SEGMENT_RE = re.compile(r"/(?:[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|[0-9a-fA-F]{16,}|\d+)(?=/|$)")
+
+# Préfixes par défaut : chemins exclus des métriques API et endpoints RAG
+_DEFAULT_EXCLUDE_PATHS = ("/docs", "/redoc", "/openapi.json", "/favicon.ico")
+_DEFAULT_RAG_ENDPOINTS = ("/ask-question", "/ask-question-stream", "/ask-question-stream-ultra")
+
+# Une requête lente sur N est journalisée (la première de chaque série)
+_SLOW_LOG_SAMPLE = 10
+
+
+def _endpoint_label(scope: Scope) -> str:
+    """Label d'endpoint borné : modèle de la route ("/documents/{document_id}"), pas l'URL brute"""
+    route = scope.get("route")
+    template = getattr(route, "path_format", None) or getattr(route, "path", None)
+    if template:
+        return template
+    return _ID_SEGMENT_RE.sub("/{id}", scope["path"])
+
+
+def _classify_error(status_code: int, exc: Exception = None) -> str:
+    """Label d'erreur borné : client_error, server_error ou timeout (jamais le nom de classe)"""
+    if isinstance(exc, TimeoutError):
+        return "timeout"
+    # Les HTTPException sont déjà converties en réponses par FastAPI : seul le statut est visible ici
+    return "client_error" if status_code < 500 else "server_error"
+
+
+class UnifiedMetricsMiddleware:
     """
-    Middleware pour collecter automatiquement les métriques sur chaque requête API
+    Middleware ASGI unique collectant les métriques API, RAG et cache de chaque requête
+    (un seul horodatage, une seule classification du chemin, un seul wrapper de send)
     """
-    
-    def __init__(self, app, exclude_paths: list = None):
-        super().__init__(app)
-        self.exclude_paths = exclude_paths or ["/docs", "/redoc", "/openapi.json", "/favicon.ico"]
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        # Ignorer certains endpoints pour éviter la pollution des métriques
-        if any(request.url.path.startswith(path) for path in self.exclude_paths):
-            return await call_next(request)
-        
-        # Enregistrer le début de la requête
-        start_time = time.time()
-        method = request.method
-        path = request.url.path
-        
-        # Incrémenter le compteur de requêtes
-        metrics_collector.increment_counter("api_requests_total", 1.0, {
-            "method": method,
-            "endpoint": path
-        })
-        
-        # Traiter la requête
+
+    def __init__(self, app: ASGIApp, exclude_paths: list = None, rag_endpoints: list = None):
+        self.app = app
+        # Préfixes compilés en tuples : un seul str.startswith (en C) par requête
+        self._exclude_prefixes = tuple(exclude_paths or _DEFAULT_EXCLUDE_PATHS)
+        self._rag_prefixes = tuple(rag_endpoints or _DEFAULT_RAG_ENDPOINTS)
+        # Nombre de requêtes lentes vues (les compteurs Prometheus les comptent toutes)
+        self._slow_count = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Classification unique du chemin (startswith sur tuple, en C)
+        path = scope["path"]
+        # Méthode internée : une seule instance de chaîne partagée par les labels
+        method = sys.intern(scope["method"])
+        is_excluded = path.startswith(self._exclude_prefixes)
+        is_rag = path.startswith(self._rag_prefixes)
+
+        start_time = time.perf_counter()
+        response_started = False
+
+        async def send_wrapper(message: Message):
+            nonlocal response_started
+            if message["type"] == "http.response.start" and not response_started:
+                response_started = True
+                elapsed = time.perf_counter() - start_time
+                # Le routage est fait : la route correspondante est dans le scope
+                endpoint = _endpoint_label(scope)
+                status_code = message["status"]
+                error_type = _classify_error(status_code) if status_code >= 400 else None
+
+                if not is_excluded:
+                    metrics_collector.record_request_end(method, endpoint, status_code, elapsed,
+                                                         error_type=error_type)
+                    # Log échantillonné (1 sur N) des requêtes lentes, formatage différé
+                    if elapsed > 5.0:
+                        self._slow_count += 1
+                        if self._slow_count % _SLOW_LOG_SAMPLE == 1 and logger.isEnabledFor(logging.WARNING):
+                            logger.warning("Slow request: %s %s took %.2fs", method, path, elapsed)
+                if is_rag:
+                    metrics_collector.record_rag_end(endpoint, elapsed, error_type=error_type)
+
+                # Vérifier si la réponse vient du cache (en-têtes ASGI en minuscules)
+                for name, value in message.get("headers", ()):
+                    if name == b"x-cache-status":
+                        metrics_collector.record_cache_event(endpoint, value.decode("latin-1"))
+                        break
+            await send(message)
+
         try:
-            response = await call_next(request)
-            status_code = response.status_code
-            
-            # Calculer le temps de réponse
-            response_time = time.time() - start_time
-            
-            # Enregistrer les métriques de succès
-            metrics_collector.record_histogram("api_response_time_seconds", response_time, {
-                "method": method,
-                "endpoint": path,
-                "status_code": str(status_code)
-            })
-            
-            # Incrémenter le compteur de réponses par statut
-            metrics_collector.increment_counter("api_responses_total", 1.0, {
-                "method": method,
-                "endpoint": path,
-                "status_code": str(status_code)
-            })
-            
-            # Enregistrer la requête API dans les métriques spécialisées
-            success = status_code < 400
-            metrics_collector.record_api_request(success, response_time)
-            
-            # Métriques spécifiques pour les erreurs
-            if status_code >= 400:
-                metrics_collector.increment_counter("api_errors_total", 1.0, {
-                    "method": method,
-                    "endpoint": path,
-                    "status_code": str(status_code)
-                })
-            
-            # Log pour les requêtes lentes
-            if response_time > 5.0:
-                logger.warning(f"Slow request: {method} {path} took {response_time:.2f}s")
-                metrics_collector.increment_counter("api_slow_requests_total", 1.0, {
-                    "method": method,
-                    "endpoint": path
-                })
-            
-            return response
-            
+            await self.app(scope, receive, send_wrapper)
+
         except Exception as e:
+            # Erreur survenue après l'envoi des en-têtes : la réponse est déjà comptabilisée
+            if response_started:
+                raise
+
             # Calculer le temps même en cas d'erreur
-            response_time = time.time() - start_time
-            
-            # Enregistrer les métriques d'erreur
-            metrics_collector.increment_counter("api_errors_total", 1.0, {
-                "method": method,
-                "endpoint": path,
-                "status_code": "500",
-                "error_type": type(e).__name__
-            })
-            
-            metrics_collector.record_histogram("api_response_time_seconds", response_time, {
-                "method": method,
-                "endpoint": path,
-                "status_code": "500"
-            })
-            
-            # Enregistrer la requête API échouée dans les métriques spécialisées
-            metrics_collector.record_api_request(False, response_time)
-            
-            logger.error(f"Request error: {method} {path} - {str(e)}")
-            
-            # Re-lever l'exception
-            raise e
+            elapsed = time.perf_counter() - start_time
+            endpoint = _endpoint_label(scope)
 
-class RAGMetricsMiddleware(BaseHTTPMiddleware):
-    """
-    Middleware spécialisé pour collecter les métriques des opérations RAG
-    """
-    
-    def __init__(self, app):
-        super().__init__(app)
-        self.rag_endpoints = ["/ask-question", "/ask-question-stream", "/ask-question-stream-ultra"]
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        # Vérifier si c'est un endpoint RAG
-        is_rag_endpoint = any(request.url.path.startswith(endpoint) for endpoint in self.rag_endpoints)
-        
-        if not is_rag_endpoint:
-            return await call_next(request)
-        
-        start_time = time.time()
-        
-        try:
-            response = await call_next(request)
-            
-            # Calculer le temps de traitement RAG
-            processing_time = time.time() - start_time
-            
-            # Métriques spécifiques RAG
-            metrics_collector.record_histogram("rag_processing_time_seconds", processing_time, {
-                "endpoint": request.url.path,
-                "status": "success"
-            })
-            
-            metrics_collector.increment_counter("rag_queries_total", 1.0, {
-                "endpoint": request.url.path,
-                "status": "success"
-            })
-            
-            # Enregistrer la requête RAG dans les métriques spécialisées
-            metrics_collector.record_rag_query("rag", total_time=processing_time)
-            
-            # Métriques de performance RAG
-            if processing_time > 10.0:
-                metrics_collector.increment_counter("rag_slow_queries_total", 1.0, {
-                    "endpoint": request.url.path
-                })
-            
-            return response
-            
-        except Exception as e:
-            processing_time = time.time() - start_time
-            
-            # Métriques d'erreur RAG
-            metrics_collector.record_histogram("rag_processing_time_seconds", processing_time, {
-                "endpoint": request.url.path,
-                "status": "error"
-            })
-            
-            metrics_collector.increment_counter("rag_queries_total", 1.0, {
-                "endpoint": request.url.path,
-                "status": "error"
-            })
-            
-            metrics_collector.increment_counter("rag_errors_total", 1.0, {
-                "endpoint": request.url.path,
-                "error_type": type(e).__name__
-            })
-            
-            # Enregistrer la requête RAG échouée dans les métriques spécialisées
-            metrics_collector.record_rag_query("rag", total_time=processing_time)
-            
-            raise e
-
-class CacheMetricsMiddleware(BaseHTTPMiddleware):
-    """
-    Middleware pour collecter les métriques de cache
-    """
-    
-    def __init__(self, app):
-        super().__init__(app)
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        # Ajouter un header pour tracker les hits/miss de cache
-        response = await call_next(request)
-        
-        # Vérifier si la réponse vient du cache
-        cache_status = response.headers.get("X-Cache-Status", "unknown")
-        
-        if cache_status in ["hit", "miss"]:
-            metrics_collector.increment_counter("cache_operations_total", 1.0, {
-                "status": cache_status,
-                "endpoint": request.url.path
-            })
-            
-            if cache_status == "hit":
-                metrics_collector.increment_counter("cache_hits_total", 1.0, {
-                    "endpoint": request.url.path
-                })
-            else:
-                metrics_collector.increment_counter("cache_misses_total", 1.0, {
-                    "endpoint": request.url.path
-                })
-        
-        return response
\ No newline at end of file
+            error_type = _classify_error(500, e)
+            if not is_excluded:
+                metrics_collector.record_request_end(method, endpoint, 500, elapsed, error_type=error_type)
+                logger.error(f"Request error: {method} {path} - {str(e)}")
+            if is_rag:
+                metrics_collector.record_rag_end(endpoint, elapsed, error_type=error_type)
+
+            # Re-lever l'exception
+            raise
@@ -1,15 +1,79 @@
+import io
 import csv
+import time
 import asyncio
 import aiofiles
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Set
 from pathlib import Path
 import json
 import uuid
-from queue import Queue
-import threading
+from collections import deque
 from app.utils.logging import logger
 
+# orjson optionnel : sérialisation JSON native, repli sur json de la stdlib
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+if ORJSON_AVAILABLE:
+    def _json_dumps(value: Any) -> str:
+        """Sérialise une valeur en JSON (orjson)"""
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
+else:
+    _json_dumps = json.dumps
+
+# Horodatage ISO : préfixe à la seconde mis en cache [préfixe, seconde epoch],
+# seules les microsecondes sont formatées à chaque appel
+_NOW_CACHE = ["", -1]
+
+
+def _iso_now() -> str:
+    """Équivalent de datetime.now().isoformat() (heure locale, microsecondes)"""
+    now = time.time()
+    second = int(now)
+    if second != _NOW_CACHE[1]:
+        _NOW_CACHE[0] = datetime.fromtimestamp(second).isoformat()
+        _NOW_CACHE[1] = second
+    return f"{_NOW_CACHE[0]}.{int((now - second) * 1_000_000):06d}"
+
+# Schémas des fichiers CSV : ordre des colonnes des lignes (tuples) de chaque méthode log_*
+FIELDNAMES_ASK_ULTRA = (
+    "response_id", "timestamp", "question", "response", "sources", "confidence_score",
+    "processing_time_ms", "tokens_used", "model_used", "cache_hit", "error_message",
+)
+FIELDNAMES_ASK_STREAM_ULTRA = (
+    "response_id", "timestamp", "question", "response_chunks", "final_response", "sources",
+    "confidence_score", "processing_time_ms", "tokens_used", "model_used", "cache_hit",
+    "stream_duration_ms", "chunk_count", "error_message",
+)
+FIELDNAMES_MULTIMODAL_QUESTION = (
+    "response_id", "timestamp", "question", "images_count", "image_descriptions", "response",
+    "sources", "confidence_score", "processing_time_ms", "tokens_used", "model_used", "cache_hit",
+    "multimodal_analysis", "ocr_text", "image_similarity_scores", "error_message",
+)
+FIELDNAMES_MULTIMODAL_WITH_IMAGE = (
+    "response_id", "timestamp", "question", "query_image_info", "image_analysis", "response",
+    "sources", "confidence_score", "processing_time_ms", "tokens_used", "model_used", "cache_hit",
+    "ocr_extracted_text", "image_caption", "image_size", "image_format", "similarity_matches",
+    "error_message",
+)
+FIELDNAMES_USER_SATISFACTION = (
+    "satisfaction_id", "timestamp", "response_id", "question", "response", "is_satisfied",
+    "error_message",
+)
+
+FIELDNAMES = {
+    "ask_question_ultra": FIELDNAMES_ASK_ULTRA,
+    "ask_question_stream_ultra": FIELDNAMES_ASK_STREAM_ULTRA,
+    "ask_multimodal_question": FIELDNAMES_MULTIMODAL_QUESTION,
+    "ask_multimodal_with_image": FIELDNAMES_MULTIMODAL_WITH_IMAGE,
+    "user_satisfaction": FIELDNAMES_USER_SATISFACTION,
+}
+
 class AsyncCSVLogger:
     """Service d'enregistrement asynchrone des réponses dans des fichiers CSV"""
     
@@ -25,65 +89,147 @@ class AsyncCSVLogger:
             "user_satisfaction": "user_satisfaction.csv"
         }
         
-        # Queue pour les tâches d'écriture asynchrone
-        self.write_queue = Queue()
-        self.worker_thread = None
+        # File d'attente deque (append/popleft atomiques) + événement de réveil,
+        # consommée par une tâche d'écriture unique démarrée au premier log
+        self._deque: deque = deque()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self.worker_task: Optional[asyncio.Task] = None
         self.is_running = False
-        self._start_worker()
+        
+        # Écriture par lots : au plus batch_size lignes ou flush_interval secondes d'attente
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        
+        # Fichiers CSV ouverts une seule fois
+        self._open_files: Dict[str, Any] = {}
+        # Tampon mémoire et csv.writer réutilisés par type d'endpoint
+        self._writers: Dict[str, tuple] = {}
+        
+        # En-têtes déjà présents (fichier existant et non vide), vérifié une seule fois
+        self._headers_written: Set[str] = set()
+        for endpoint_type, filename in self.csv_files.items():
+            file_path = self.analysis_path / filename
+            if file_path.exists() and file_path.stat().st_size > 0:
+                self._headers_written.add(endpoint_type)
     
     def _start_worker(self):
-        """Démarre le thread worker pour l'écriture asynchrone"""
+        """Démarre la tâche d'écriture dans la boucle asyncio courante"""
         if not self.is_running:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # Appel hors boucle : la ligne reste en file jusqu'au prochain démarrage
+                return
+            self._stopping = False
+            self.worker_task = loop.create_task(self._async_worker())
             self.is_running = True
-            self.worker_thread = threading.Thread(target=self._worker, daemon=True)
-            self.worker_thread.start()
     
-    def _worker(self):
-        """Worker thread pour traiter la queue d'écriture"""
-        while self.is_running:
-            try:
-                if not self.write_queue.empty():
-                    task = self.write_queue.get(timeout=1)
-                    if task is None:  # Signal d'arrêt
-                        break
-                    self._write_to_csv_sync(task)
-                    self.write_queue.task_done()
-                else:
-                    # Petite pause si la queue est vide
-                    threading.Event().wait(0.1)
-            except Exception as e:
-                logger.error(f"Erreur dans le worker CSV: {e}")
+    def _enqueue(self, endpoint_type: str, row: tuple):
+        """Ajoute une ligne à écrire (jamais bloquant)"""
+        self._deque.append((endpoint_type, row))
+        self._start_worker()
+        self._wake.set()
     
-    def _write_to_csv_sync(self, task: Dict[str, Any]):
-        """Écriture synchrone dans le fichier CSV"""
-        try:
-            endpoint_type = task["endpoint_type"]
-            data = task["data"]
+    async def _async_worker(self):
+        """Tâche asyncio regroupant les lignes par fichier et les écrivant par lots"""
+        loop = asyncio.get_running_loop()
+        pending: Dict[str, List[tuple]] = {}
+        deadline = None
+        
+        while True:
+            if not self._deque:
+                if self._stopping:
+                    break
+                # Attendre un réveil au plus jusqu'à l'échéance du lot en cours
+                timeout = None if deadline is None else max(0.0, deadline - loop.time())
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    await self._flush_all(pending)
+                    deadline = None
+                    continue
+                self._wake.clear()
             
-            if endpoint_type not in self.csv_files:
-                logger.error(f"Type d'endpoint inconnu: {endpoint_type}")
-                return
+            while self._deque:
+                endpoint_type, row = self._deque.popleft()
+                if endpoint_type not in self.csv_files:
+                    logger.error(f"Type d'endpoint inconnu: {endpoint_type}")
+                    continue
+                
+                rows = pending.setdefault(endpoint_type, [])
+                rows.append(row)
+                if deadline is None:
+                    deadline = loop.time() + self.flush_interval
+                
+                if len(rows) >= self.batch_size:
+                    await self._flush(endpoint_type, pending.pop(endpoint_type))
+                    if not pending:
+                        deadline = None
             
+            # Flux continu : l'échéance du lot peut expirer sans jamais attendre
+            if deadline is not None and loop.time() >= deadline:
+                await self._flush_all(pending)
+                deadline = None
+        
+        await self._flush_all(pending)
+        await self._close_files()
+    
+    async def _flush_all(self, pending: Dict[str, List[tuple]]):
+        """Écrit tous les lots en attente"""
+        for endpoint_type, rows in pending.items():
+            await self._flush(endpoint_type, rows)
+        pending.clear()
+    
+    async def _get_file(self, endpoint_type: str):
+        """Retourne le fichier CSV ouvert en ajout pour ce type d'endpoint"""
+        csv_file = self._open_files.get(endpoint_type)
+        if csv_file is None:
             # Créer le dossier d'analyse s'il n'existe pas
             self.analysis_path.mkdir(parents=True, exist_ok=True)
             
             file_path = self.analysis_path / self.csv_files[endpoint_type]
+            csv_file = await aiofiles.open(file_path, 'a', newline='', encoding='utf-8')
+            self._open_files[endpoint_type] = csv_file
+        return csv_file
+    
+    def _get_writer(self, endpoint_type: str):
+        """Retourne le tampon et le csv.writer de ce type d'endpoint (créés une seule fois)"""
+        entry = self._writers.get(endpoint_type)
+        if entry is None:
+            buffer = io.StringIO()
+            entry = self._writers[endpoint_type] = (buffer, csv.writer(buffer))
+        return entry
+    
+    async def _flush(self, endpoint_type: str, rows: List[tuple]):
+        """Écriture asynchrone d'un lot de lignes dans le fichier CSV"""
+        try:
+            csv_file = await self._get_file(endpoint_type)
             
-            # Vérifier si le fichier existe
-            file_exists = file_path.exists()
+            # Formatage CSV du lot dans le tampon réutilisé puis une seule écriture
+            buffer, writer = self._get_writer(endpoint_type)
+            buffer.seek(0)
+            buffer.truncate()
             
-            with open(file_path, 'a', newline='', encoding='utf-8') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=data.keys())
-                
-                # Écrire l'en-tête si le fichier est nouveau ou vide
-                if not file_exists or file_path.stat().st_size == 0:
-                    writer.writeheader()
-                
-                writer.writerow(data)
+            # Écrire l'en-tête si le fichier est nouveau ou vide
+            if endpoint_type not in self._headers_written:
+                writer.writerow(FIELDNAMES[endpoint_type])
+                self._headers_written.add(endpoint_type)
+            
+            writer.writerows(rows)
+            
+            await csv_file.write(buffer.getvalue())
+            await csv_file.flush()
                 
         except Exception as e:
             logger.error(f"Erreur lors de l'écriture CSV: {e}")
     
+    async def _close_files(self):
+        """Ferme les fichiers CSV ouverts"""
+        for csv_file in self._open_files.values():
+            await csv_file.close()
+        self._open_files.clear()
+    
     def log_ask_question_ultra(self, 
                               question: str,
                               response: str,
@@ -97,24 +243,22 @@ class AsyncCSVLogger:
                               error_message: Optional[str] = None):
         """Enregistre une réponse de l'endpoint ask-question-ultra"""
         
-        data = {
-            "response_id": response_id or str(uuid.uuid4()),
-            "timestamp": datetime.now().isoformat(),
-            "question": question,
-            "response": response,
-            "sources": json.dumps(sources) if sources else "",
-            "confidence_score": confidence_score or "",
-            "processing_time_ms": processing_time_ms or "",
-            "tokens_used": tokens_used or "",
-            "model_used": model_used or "",
-            "cache_hit": cache_hit if cache_hit is not None else "",
-            "error_message": error_message or ""
-        }
+        # Ligne positionnelle dans l'ordre de FIELDNAMES (sans dictionnaire intermédiaire)
+        row = (
+            response_id or str(uuid.uuid4()),  # response_id
+            _iso_now(),  # timestamp
+            question,
+            response,
+            _json_dumps(sources) if sources else "",  # sources
+            confidence_score or "",  # confidence_score
+            processing_time_ms or "",  # processing_time_ms
+            tokens_used or "",  # tokens_used
+            model_used or "",  # model_used
+            cache_hit if cache_hit is not None else "",  # cache_hit
+            error_message or "",  # error_message
+        )
         
-        self.write_queue.put({
-            "endpoint_type": "ask_question_ultra",
-            "data": data
-        })
+        self._enqueue("ask_question_ultra", row)
     
     def log_ask_question_stream_ultra(self,
                                      question: str,
@@ -132,27 +276,25 @@ class AsyncCSVLogger:
                                      error_message: Optional[str] = None):
         """Enregistre une réponse de l'endpoint ask-question-stream-ultra"""
         
-        data = {
-            "response_id": response_id or str(uuid.uuid4()),
-            "timestamp": datetime.now().isoformat(),
-            "question": question,
-            "response_chunks": json.dumps(response_chunks) if response_chunks else "",
-            "final_response": final_response or "",
-            "sources": json.dumps(sources) if sources else "",
-            "confidence_score": confidence_score or "",
-            "processing_time_ms": processing_time_ms or "",
-            "tokens_used": tokens_used or "",
-            "model_used": model_used or "",
-            "cache_hit": cache_hit if cache_hit is not None else "",
-            "stream_duration_ms": stream_duration_ms or "",
-            "chunk_count": chunk_count or "",
-            "error_message": error_message or ""
-        }
+        # Ligne positionnelle dans l'ordre de FIELDNAMES (sans dictionnaire intermédiaire)
+        row = (
+            response_id or str(uuid.uuid4()),  # response_id
+            _iso_now(),  # timestamp
+            question,
+            _json_dumps(response_chunks) if response_chunks else "",  # response_chunks
+            final_response or "",  # final_response
+            _json_dumps(sources) if sources else "",  # sources
+            confidence_score or "",  # confidence_score
+            processing_time_ms or "",  # processing_time_ms
+            tokens_used or "",  # tokens_used
+            model_used or "",  # model_used
+            cache_hit if cache_hit is not None else "",  # cache_hit
+            stream_duration_ms or "",  # stream_duration_ms
+            chunk_count or "",  # chunk_count
+            error_message or "",  # error_message
+        )
         
-        self.write_queue.put({
-            "endpoint_type": "ask_question_stream_ultra",
-            "data": data
-        })
+        self._enqueue("ask_question_stream_ultra", row)
     
     def log_ask_multimodal_question(self,
                                    question: str,
@@ -172,29 +314,27 @@ class AsyncCSVLogger:
                                    error_message: Optional[str] = None):
         """Enregistre une réponse de l'endpoint ask-multimodal-question"""
         
-        data = {
-            "response_id": response_id or str(uuid.uuid4()),
-            "timestamp": datetime.now().isoformat(),
-            "question": question,
-            "images_count": images_count or "",
-            "image_descriptions": json.dumps(image_descriptions) if image_descriptions else "",
-            "response": response or "",
-            "sources": json.dumps(sources) if sources else "",
-            "confidence_score": confidence_score or "",
-            "processing_time_ms": processing_time_ms or "",
-            "tokens_used": tokens_used or "",
-            "model_used": model_used or "",
-            "cache_hit": cache_hit if cache_hit is not None else "",
-            "multimodal_analysis": json.dumps(multimodal_analysis) if multimodal_analysis else "",
-            "ocr_text": ocr_text or "",
-            "image_similarity_scores": json.dumps(image_similarity_scores) if image_similarity_scores else "",
-            "error_message": error_message or ""
-        }
+        # Ligne positionnelle dans l'ordre de FIELDNAMES (sans dictionnaire intermédiaire)
+        row = (
+            response_id or str(uuid.uuid4()),  # response_id
+            _iso_now(),  # timestamp
+            question,
+            images_count or "",  # images_count
+            _json_dumps(image_descriptions) if image_descriptions else "",  # image_descriptions
+            response or "",  # response
+            _json_dumps(sources) if sources else "",  # sources
+            confidence_score or "",  # confidence_score
+            processing_time_ms or "",  # processing_time_ms
+            tokens_used or "",  # tokens_used
+            model_used or "",  # model_used
+            cache_hit if cache_hit is not None else "",  # cache_hit
+            _json_dumps(multimodal_analysis) if multimodal_analysis else "",  # multimodal_analysis
+            ocr_text or "",  # ocr_text
+            _json_dumps(image_similarity_scores) if image_similarity_scores else "",  # image_similarity_scores
+            error_message or "",  # error_message
+        )
         
-        self.write_queue.put({
-            "endpoint_type": "ask_multimodal_question",
-            "data": data
-        })
+        self._enqueue("ask_multimodal_question", row)
     
     def log_ask_multimodal_with_image(self,
                                      question: str,
@@ -216,31 +356,29 @@ class AsyncCSVLogger:
                                      error_message: Optional[str] = None):
         """Enregistre une réponse de l'endpoint ask-multimodal-with-image"""
         
-        data = {
-            "response_id": response_id or str(uuid.uuid4()),
-            "timestamp": datetime.now().isoformat(),
-            "question": question,
-            "query_image_info": json.dumps(query_image_info) if query_image_info else "",
-            "image_analysis": json.dumps(image_analysis) if image_analysis else "",
-            "response": response or "",
-            "sources": json.dumps(sources) if sources else "",
-            "confidence_score": confidence_score or "",
-            "processing_time_ms": processing_time_ms or "",
-            "tokens_used": tokens_used or "",
-            "model_used": model_used or "",
-            "cache_hit": cache_hit if cache_hit is not None else "",
-            "ocr_extracted_text": ocr_extracted_text or "",
-            "image_caption": image_caption or "",
-            "image_size": image_size or "",
-            "image_format": image_format or "",
-            "similarity_matches": json.dumps(similarity_matches) if similarity_matches else "",
-            "error_message": error_message or ""
-        }
+        # Ligne positionnelle dans l'ordre de FIELDNAMES (sans dictionnaire intermédiaire)
+        row = (
+            response_id or str(uuid.uuid4()),  # response_id
+            _iso_now(),  # timestamp
+            question,
+            _json_dumps(query_image_info) if query_image_info else "",  # query_image_info
+            _json_dumps(image_analysis) if image_analysis else "",  # image_analysis
+            response or "",  # response
+            _json_dumps(sources) if sources else "",  # sources
+            confidence_score or "",  # confidence_score
+            processing_time_ms or "",  # processing_time_ms
+            tokens_used or "",  # tokens_used
+            model_used or "",  # model_used
+            cache_hit if cache_hit is not None else "",  # cache_hit
+            ocr_extracted_text or "",  # ocr_extracted_text
+            image_caption or "",  # image_caption
+            image_size or "",  # image_size
+            image_format or "",  # image_format
+            _json_dumps(similarity_matches) if similarity_matches else "",  # similarity_matches
+            error_message or "",  # error_message
+        )
         
-        self.write_queue.put({
-            "endpoint_type": "ask_multimodal_with_image",
-            "data": data
-        })
+        self._enqueue("ask_multimodal_with_image", row)
     
     def log_user_satisfaction(self,
                             satisfaction_id: str,
@@ -251,32 +389,31 @@ class AsyncCSVLogger:
                             error_message: Optional[str] = None):
         """Enregistre la satisfaction utilisateur pour une réponse"""
         
-        data = {
-            "satisfaction_id": satisfaction_id,
-            "timestamp": datetime.now().isoformat(),
-            "response_id": response_id,
-            "question": question,
-            "response": response,
-            "is_satisfied": is_satisfied,
-            "error_message": error_message or ""
-        }
+        # Ligne positionnelle dans l'ordre de FIELDNAMES (sans dictionnaire intermédiaire)
+        row = (
+            satisfaction_id,
+            _iso_now(),  # timestamp
+            response_id,
+            question,
+            response,
+            is_satisfied,
+            error_message or "",  # error_message
+        )
         
-        self.write_queue.put({
-            "endpoint_type": "user_satisfaction",
-            "data": data
-        })
+        self._enqueue("user_satisfaction", row)
     
-    def stop(self):
-        """Arrête le service de logging"""
-        self.is_running = False
-        if self.worker_thread and self.worker_thread.is_alive():
+    async def stop(self):
+        """Arrête le service de logging après écriture des tâches en attente"""
+        if self.worker_task and not self.worker_task.done():
             # Signal d'arrêt
-            self.write_queue.put(None)
-            self.worker_thread.join(timeout=5)
+            self._stopping = True
+            self._wake.set()
+            await asyncio.wait_for(self.worker_task, timeout=5)
+        self.is_running = False
     
     def get_queue_size(self) -> int:
         """Retourne la taille actuelle de la queue"""
-        return self.write_queue.qsize()
+        return len(self._deque)
 
 # Instance globale du logger CSV
 csv_logger = AsyncCSVLogger()
\ No newline at end of file
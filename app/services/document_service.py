@@ -1,42 +1,132 @@
+import io
 import os
-import tempfile
+import re
+import asyncio
+import hashlib
+import multiprocessing
+import aiofiles.os
+import aiofiles.tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
 from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
 from app.utils.logging import logger
 
+# Normalisation des espaces en une seule passe
+_WS_RE = re.compile(r"\s+")
+# Suppression des caractères null via str.translate
+_NULL_TABLE = {0: None}
+
+# Pool de processus pour le parsing (CPU) des documents, créé au premier usage.
+# Contexte "spawn" : pas de fork d'un processus qui a déjà des threads (métriques, modèles)
+_DOCUMENT_POOL: Optional[ProcessPoolExecutor] = None
+
+
+def _get_document_pool() -> ProcessPoolExecutor:
+    """Retourne le pool de parsing, en le créant si besoin"""
+    global _DOCUMENT_POOL
+    if _DOCUMENT_POOL is None:
+        _DOCUMENT_POOL = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _DOCUMENT_POOL
+
+
+def shutdown_document_pool():
+    """Arrête le pool de parsing des documents"""
+    global _DOCUMENT_POOL
+    if _DOCUMENT_POOL is not None:
+        _DOCUMENT_POOL.shutdown(wait=False, cancel_futures=True)
+        _DOCUMENT_POOL = None
+
+
+# Cache LRU des textes extraits, indexé par empreinte du contenu (+ extension) :
+# un document déjà téléversé n'est pas reparsé
+_DOC_CACHE: "OrderedDict[bytes, str]" = OrderedDict()
+_DOC_CACHE_MAX_SIZE = 128
+# Extractions en cours par empreinte : un même fichier envoyé en parallèle n'est parsé qu'une fois
+_DOC_INFLIGHT: Dict[bytes, asyncio.Future] = {}
+
+
+def _parse_pdf_sync(file_path: str) -> List[str]:
+    """Extrait le texte de chaque page d'un PDF (exécuté dans le pool de processus)"""
+    return [page.page_content for page in PyPDFLoader(file_path).load()]
+
+
+def _parse_docx_sync(file_path: str) -> str:
+    """Extrait le texte d'un document Word (exécuté dans le pool de processus)"""
+    return Docx2txtLoader(file_path).load()[0].page_content
+
 
 async def process_document_advanced(file_content: bytes, filename: str) -> str:
     """Traitement avancé de document avec extraction améliorée"""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as temp_file:
-        temp_file.write(file_content)
+    extension = os.path.splitext(filename)[1].lower()
+    key = hashlib.blake2b(file_content, digest_size=16).digest() + extension.encode()
+
+    text = _DOC_CACHE.get(key)
+    if text is not None:
+        _DOC_CACHE.move_to_end(key)
+        return text
+
+    inflight = _DOC_INFLIGHT.get(key)
+    if inflight is not None:
+        return await asyncio.shield(inflight)
+
+    future = asyncio.get_running_loop().create_future()
+    _DOC_INFLIGHT[key] = future
+    try:
+        text = await _extract_document_text(file_content, filename)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Exception récupérée ici : pas d'avertissement si aucun appel concurrent n'attend
+        future.exception()
+        raise
+    else:
+        future.set_result(text)
+        _DOC_CACHE[key] = text
+        if len(_DOC_CACHE) > _DOC_CACHE_MAX_SIZE:
+            _DOC_CACHE.popitem(last=False)
+        return text
+    finally:
+        del _DOC_INFLIGHT[key]
+
+
+async def _extract_document_text(file_content: bytes, filename: str) -> str:
+    """Extraction et normalisation du texte d'un document PDF ou Word"""
+    # Écriture du fichier temporaire déléguée à un thread (hors de la boucle asyncio)
+    async with aiofiles.tempfile.NamedTemporaryFile("wb", delete=False, suffix=os.path.splitext(filename)[1]) as temp_file:
+        await temp_file.write(file_content)
         file_path = temp_file.name
 
+    loop = asyncio.get_running_loop()
     try:
         if filename.lower().endswith('.pdf'):
-            loader = PyPDFLoader(file_path)
-            pages = loader.load()
+            pages = await loop.run_in_executor(_get_document_pool(), _parse_pdf_sync, file_path)
 
-            # Extraction avec métadonnées de page
-            text_parts = []
-            for page_num, page in enumerate(pages):
-                page_text = page.page_content.strip()
+            # Extraction avec métadonnées de page, construite incrémentalement
+            buffer = io.StringIO()
+            for page_num, page_content in enumerate(pages):
+                page_text = page_content.strip()
                 if page_text:
-                    text_parts.append(f"[Page {page_num + 1}]\n{page_text}")
+                    buffer.write(f"[Page {page_num + 1}]\n{page_text}\n\n")
 
-            text = '\n\n'.join(text_parts)
+            text = buffer.getvalue()
 
         elif filename.lower().endswith(('.docx', '.doc')):
-            loader = Docx2txtLoader(file_path)
-            document = loader.load()[0]
-            text = document.page_content
+            text = await loop.run_in_executor(_get_document_pool(), _parse_docx_sync, file_path)
 
         else:
             raise ValueError("Format non supporté. Formats acceptés: PDF, DOC, DOCX")
 
         # Nettoyage et normalisation du texte
-        text = text.replace('\x00', '')  # Suppression caractères null
-        text = ' '.join(text.split())  # Normalisation espaces
+        text = text.translate(_NULL_TABLE)  # Suppression caractères null
+        text = _WS_RE.sub(' ', text).strip()  # Normalisation espaces
 
         return text
 
     finally:
-        os.unlink(file_path)
+        await aiofiles.os.unlink(file_path)
@@ -1,16 +1,17 @@
 import chromadb
+import hashlib
+import numpy as np
 import uuid
 import time
 import asyncio
 from datetime import datetime
-from typing import Dict, Any, List, Optional, Union
-from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, AsyncGenerator, List, Optional, Union
 
 from fastapi import HTTPException
 
 from app.core.embeddings import AdvancedEmbeddings
 from app.core.chunker import AdvancedChunker
-from app.core.search import HybridSearch, SearchResult
+from app.core.search import HybridSearch, SearchResult, deduplicate_results
 from app.core.reranker import AdvancedReranker, RankedResult
 from app.core.query_enhancer import QueryEnhancer
 from app.core.llm_provider import OptimizedLLMProvider, PROVIDER_CONFIGS
@@ -25,6 +26,26 @@ from app.utils.logging import logger
 from app.core.cache import cache
 from app.core.config import settings
 
+# Nombre maximal de candidats (dédupliqués) soumis au cross-encoder
+RERANK_CANDIDATES = 30
+
+# Gabarit du prompt RAG construit une seule fois (str.format ne réinterprète pas les valeurs substituées)
+_PROMPT_TEMPLATE = """Vous êtes un assistant expert de la Caisse de Sécurité Sociale du Sénégal.
+
+CONTEXTE:
+{ctx}
+
+QUESTION: {q}
+
+INSTRUCTIONS:
+1. Répondez de manière naturelle et professionnelle
+2. Utilisez uniquement les informations fournies dans le contexte
+3. Si les informations sont insuffisantes, proposez de reformuler la question
+4. Soyez précis et concis
+5. Synthétisez les informations de manière cohérente
+
+RÉPONSE:"""
+
 
 # RAG Ultra Performant - Classe principale
 class UltraPerformantRAG:
@@ -50,6 +71,8 @@ class UltraPerformantRAG:
         # Composants multimodaux (chargement différé)
         self.multimodal_embeddings = None
         self.multimodal_processor = None
+        # Verrou : deux premières requêtes concurrentes ne chargent les modèles qu'une fois
+        self._mm_lock = asyncio.Lock()
 
         # ChromaDB avec gestion d'erreurs
         try:
@@ -67,7 +90,8 @@ class UltraPerformantRAG:
                     self.embeddings_model = embeddings_model
 
                 def __call__(self, texts):
-                    return self.embeddings_model.embed_documents(texts)
+                    # Matrice float32 contiguë : pas de listes Python de floats
+                    return np.asarray(self.embeddings_model.embed_documents(texts), dtype=np.float32)
 
             self.embedding_function = CustomEmbeddingFunction(self.embeddings)
 
@@ -83,10 +107,12 @@ class UltraPerformantRAG:
             raise
 
         # Recherche hybride
-        self.hybrid_search = HybridSearch(self.collection, self.embeddings)
+        self.hybrid_search = HybridSearch(
+            self.collection, self.embeddings, index_path="./ultra_rag_db/bm25_index.pkl"
+        )
 
-        # Pool de threads pour opérations parallèles
-        self.executor = ThreadPoolExecutor(max_workers=2)
+        # Pas de pool de threads dédié : les appels bloquants (ChromaDB, encodage, mise à jour
+        # BM25 vectorisée NumPy) passent par asyncio.to_thread, sans plafond à 2 threads
         
         logger.info("UltraPerformantRAG initialisé avec support multimodal")
 
@@ -99,8 +125,13 @@ class UltraPerformantRAG:
             chunks_data = self.chunker.chunk_document(text, document_id)
 
             # Suppression des anciens chunks du même document
+            removed_ids = []
             try:
-                self.collection.delete(where={"document_id": document_id})
+                removed_ids = (await asyncio.to_thread(
+                    self.collection.get, where={"document_id": document_id}, include=[]
+                ))["ids"]
+                if removed_ids:
+                    await asyncio.to_thread(self.collection.delete, ids=removed_ids)
             except:
                 pass
 
@@ -109,21 +140,20 @@ class UltraPerformantRAG:
             metadatas = [chunk["metadata"] for chunk in chunks_data]
             ids = [metadata["chunk_id"] for metadata in metadatas]
 
-            # Insertion par batch
-            batch_size = 50
+            # Insertion par batch (lots de 500 : moins de transactions ChromaDB,
+            # et un seul encodage groupé par lot via la fonction d'embedding)
+            batch_size = 500
             for i in range(0, len(documents), batch_size):
                 end_idx = min(i + batch_size, len(documents))
-                self.collection.add(
+                await asyncio.to_thread(
+                    self.collection.add,
                     documents=documents[i:end_idx],
                     metadatas=metadatas[i:end_idx],
                     ids=ids[i:end_idx]
                 )
 
-            # Reconstruction de l'index BM25
-            await asyncio.get_event_loop().run_in_executor(
-                self.executor,
-                self.hybrid_search.rebuild_index
-            )
+            # Mise à jour incrémentale de l'index BM25 (seuls les chunks ajoutés/retirés)
+            await asyncio.to_thread(self.hybrid_search.add_to_index, chunks_data, removed_ids)
 
             processing_time = time.time() - start_time
 
@@ -138,186 +168,160 @@ class UltraPerformantRAG:
             logger.error(f"Erreur ajout document: {e}")
             raise HTTPException(status_code=500, detail=f"Erreur traitement document: {str(e)}")
 
-    async def add_multimodal_document(self, file_content: bytes, filename: str, 
-                                    extract_text: bool = True, 
-                                    generate_captions: bool = True) -> Dict[str, Any]:
-        """
-        Ajoute un document multimodal (image ou PDF) au système RAG.
-        
-        Args:
-            file_content: Contenu du fichier en bytes
-            filename: Nom du fichier
-            extract_text: Si True, extrait le texte des images via OCR
-            generate_captions: Si True, génère des légendes pour les images
-            
-        Returns:
-            Dict contenant les informations sur le document ajouté
-        """
-        try:
-            logger.info(f"Ajout du document multimodal: {filename}")
-            
-            # Traitement du document multimodal
-            processed_data = await self.multimodal_processor.process_multimodal_document(
-                file_content, filename, extract_text, generate_captions
-            )
-            
-            # Génération d'un ID unique pour le document
-            document_id = f"multimodal_{filename}_{hash(file_content) % 1000000}"
-            
-            # Ajout du document au système RAG
-            added_chunks = []
-            chunk_id = f"{document_id}_chunk_0"
-            
-            # Création des métadonnées enrichies
-            metadata = {
-                'document_id': document_id,
-                'chunk_id': chunk_id,
-                'filename': filename,
-                'chunk_index': 0,
-                'content_type': processed_data['metadata']['content_type'],
-                'modality': processed_data['metadata']['modality'],
-                'has_image': 'image' in processed_data,
-                'has_text': len(processed_data.get('content', '')) > 0,
-                'ocr_confidence': None,
-                'caption_confidence': None
+    def _predefined_response(self, question: str, query_id: str, start_time: float) -> Optional[Dict[str, Any]]:
+        """Réponse issue des Q&A prédéfinies, ou None si aucune ne correspond"""
+        if not self.predefined_qa:
+            return None
+        predefined_response = self.predefined_qa.get_predefined_answer(question)
+        if not predefined_response:
+            return None
+
+        logger.info(f"Réponse prédéfinie trouvée pour: {question[:50]}...")
+        return {
+            "id": query_id,
+            "answer": predefined_response["answer"],
+            "context_found": True,
+            "provider_used": "predefined_qa",
+            "model_used": "template_based",
+            "response_time_ms": round((time.perf_counter() - start_time) * 1000, 2),
+            "timestamp": datetime.now().isoformat(),
+            "search_results": 0,
+            "ranked_results": 0,
+            "enhanced_queries": [question],
+            "sources": [{"type": "predefined", "content": "Base de connaissances CSS", "confidence": predefined_response["confidence"]}],
+            "performance_metrics": {
+                "search_time_ms": 0,
+                "generation_time_ms": 0,
+                "cache_hits": "predefined_response",
+                "llm_calls_saved": True,
+                "optimization_used": "predefined_qa",
+                "matched_question": predefined_response["matched_question"]
             }
-                
-            # Génération des embeddings multimodaux
-            if 'image' in processed_data and processed_data['image']:
-                # Embedding d'image
-                embedding = self.multimodal_embeddings.embed_image(processed_data['image'])
-            else:
-                # Embedding de texte
-                text_content = processed_data.get('content', '')
-                if text_content:
-                    embedding = self.multimodal_embeddings.embed_multimodal_text(text_content)
-                else:
-                    raise ValueError("Aucun contenu à traiter")
-            
-            # Ajout à ChromaDB
-            self.collection.add(
-                embeddings=[embedding.tolist()],
-                documents=[processed_data.get('content', '')],
-                metadatas=[metadata],
-                ids=[chunk_id]
-            )
-            
-            added_chunks.append({
-                'chunk_id': chunk_id,
-                'content_type': metadata['content_type'],
-                'modality': metadata['modality'],
-                'text_length': len(processed_data.get('content', '')),
-                'has_image': metadata['has_image']
-            })
-            
-            result = {
-                'document_id': document_id,
-                'filename': filename,
-                'chunks_added': len(added_chunks),
-                'chunks_details': added_chunks,
-                'processing_info': {
-                    'file_type': processed_data.get('file_type'),
-                    'total_images': processed_data.get('total_images', 0),
-                    'total_text_chunks': processed_data.get('total_text_chunks', 0),
-                    'ocr_used': extract_text,
-                    'captions_generated': generate_captions
-                }
+        }
+
+    def _no_context_response(self, query_id: str, provider: Provider, enhanced_queries: List[str],
+                             start_time: float) -> Dict[str, Any]:
+        """Réponse lorsqu'aucun document pertinent n'a été trouvé"""
+        elapsed_ms = round((time.perf_counter() - start_time) * 1000, 2)
+        return {
+            "id": query_id,
+            "answer": "Je ne trouve pas d'informations spécifiques à votre question dans ma base de connaissances CSS. Pourriez-vous reformuler votre question ou être plus précis ?",
+            "context_found": False,
+            "provider_used": provider.value,
+            "model_used": PROVIDER_CONFIGS[provider]["model"],
+            "response_time_ms": elapsed_ms,
+            "timestamp": datetime.now().isoformat(),
+            "search_results": 0,
+            "ranked_results": 0,
+            "enhanced_queries": enhanced_queries,
+            "sources": [],
+            "performance_metrics": {
+                "search_time_ms": elapsed_ms,
+                "generation_time_ms": 0,
+                "cache_hits": "no_context_found"
             }
-            
-            logger.info(f"Document multimodal {filename} ajouté avec succès: {len(added_chunks)} chunks")
-            return result
-            
-        except Exception as e:
-            logger.error(f"Erreur lors de l'ajout du document multimodal {filename}: {e}")
-            raise
+        }
+
+    def _error_response(self, query_id: str, provider: Provider, error: Exception,
+                        start_time: float) -> Dict[str, Any]:
+        """Réponse renvoyée en cas d'erreur de traitement"""
+        elapsed_ms = round((time.perf_counter() - start_time) * 1000, 2)
+        return {
+            "id": query_id,
+            "answer": f"Erreur lors du traitement: {str(error)}",
+            "context_found": False,
+            "provider_used": provider.value,
+            "model_used": PROVIDER_CONFIGS.get(provider, {}).get("model", "unknown"),
+            "response_time_ms": elapsed_ms,
+            "timestamp": datetime.now().isoformat(),
+            "search_results": 0,
+            "ranked_results": 0,
+            "enhanced_queries": [],
+            "sources": [],
+            "performance_metrics": {
+                "search_time_ms": 0,
+                "generation_time_ms": elapsed_ms,
+                "cache_hits": "error_occurred"
+            }
+        }
 
-    async def multimodal_query(self, query: str, query_image: bytes = None, 
-                             k: int = 5, rerank: bool = True, 
-                             modality_filter: str = None) -> List[RankedResult]:
+    async def _retrieve_context(self, question: str, llm_provider: OptimizedLLMProvider, top_k: int):
         """
-        Effectue une requête multimodale sur le système RAG.
-        
-        Args:
-            query: Requête textuelle
-            query_image: Image de requête optionnelle (bytes)
-            k: Nombre de résultats à retourner
-            rerank: Si True, applique le reranking
-            modality_filter: Filtre par modalité ('text', 'image', 'multimodal')
-            
-        Returns:
-            Liste des résultats classés
+        Enhancement, recherche hybride et re-ranking.
+        Retourne (requêtes enrichies, résultats bruts, résultats classés) ;
+        résultats classés à None si aucun document n'a été trouvé.
         """
-        try:
-            logger.info(f"Requête multimodale: {query[:100]}...")
-            
-            # Génération de l'embedding de requête
-            if query_image:
-                # Requête avec image
-                query_embedding = await self.multimodal_embeddings.encode_image(query_image)
-                logger.info("Embedding d'image généré pour la requête")
-            else:
-                # Requête textuelle uniquement
-                query_embedding = await self.multimodal_embeddings.encode_text(query)
-                logger.info("Embedding textuel généré pour la requête")
-            
-            # Préparation des filtres de métadonnées
-            where_filter = {}
-            if modality_filter:
-                where_filter['modality'] = modality_filter
-            
-            # Recherche dans ChromaDB
-            search_results = self.collection.query(
-                query_embeddings=[query_embedding.tolist()],
-                n_results=min(k * 2, 20),  # Récupère plus de résultats pour le reranking
-                where=where_filter if where_filter else None,
-                include=['documents', 'metadatas', 'distances']
-            )
-            
-            # Conversion en format SearchResult
-            search_results_formatted = []
-            for i, (doc, metadata, distance) in enumerate(zip(
-                search_results['documents'][0],
-                search_results['metadatas'][0], 
-                search_results['distances'][0]
-            )):
-                search_results_formatted.append(SearchResult(
-                    content=doc,
-                    metadata=metadata,
-                    score=1.0 - distance,  # Conversion distance -> score
-                    source=metadata.get('filename', 'unknown')
-                ))
-            
-            # Application du reranking si demandé
-            if rerank and len(search_results_formatted) > 1:
-                logger.info(f"Application du reranking sur {len(search_results_formatted)} résultats")
-                ranked_results = await self.reranker.rerank(
-                    query=query,
-                    results=search_results_formatted,
-                    top_k=k
-                )
-            else:
-                # Conversion directe en RankedResult
-                ranked_results = [
-                    RankedResult(
-                        content=result.content,
-                        metadata=result.metadata,
-                        score=result.score,
-                        source=result.source,
-                        rank=i+1
-                    )
-                    for i, result in enumerate(search_results_formatted[:k])
-                ]
-            
-            logger.info(f"Requête multimodale terminée: {len(ranked_results)} résultats")
-            return ranked_results
-            
-        except Exception as e:
-            logger.error(f"Erreur lors de la requête multimodale: {e}")
-            raise
+        # Enhancement de la requête (LLM) et recherche hybride de la question
+        # originale en parallèle : étapes indépendantes
+        enhanced_queries, base_results = await asyncio.gather(
+            self.query_enhancer.enhance_query(question, llm_provider),
+            self.hybrid_search.search(question, n_results=15)
+        )
+        logger.info(f"Requêtes générées: {enhanced_queries}")
+
+        # Recherche hybride pour les autres variantes : un seul encodage groupé,
+        # puis recherches concurrentes
+        all_results = list(base_results)
+        other_variants = [query_variant for query_variant in enhanced_queries if query_variant != question]
+        if other_variants:
+            variant_embeddings = await asyncio.to_thread(self.embeddings.embed_queries_batch, other_variants)
+            variant_results = await asyncio.gather(*[
+                self.hybrid_search.search_with_embedding(query_variant, embedding, n_results=15)
+                for query_variant, embedding in zip(other_variants, variant_embeddings)
+            ])
+            all_results.extend(result for results in variant_results for result in results)
+
+        if not all_results:
+            return enhanced_queries, all_results, None
+
+        # Re-ranking avec cross-encoder sur les candidats dédupliqués entre variantes
+        candidates = deduplicate_results(all_results, RERANK_CANDIDATES)
+        # Cross-encoder hors de la boucle d'événements (chargement différé au premier appel, puis inférence)
+        ranked_results = await asyncio.to_thread(self.reranker.rerank, question, candidates, top_k=top_k)
+        return enhanced_queries, all_results, ranked_results
+
+    @staticmethod
+    def _build_prompt(question: str, ranked_results: List[RankedResult]):
+        """Sources et prompt optimisé à partir des résultats classés"""
+        sources = [
+            {
+                "source_id": i + 1,
+                "score": float(result.score),
+                "original_rank": result.original_rank,
+                "metadata": result.metadata
+            }
+            for i, result in enumerate(ranked_results)
+        ]
+        context = "\n\n".join(f"Source {i + 1}: {result.content}" for i, result in enumerate(ranked_results))
+        return sources, _PROMPT_TEMPLATE.format(ctx=context, q=question)
+
+    def _final_response(self, query_id: str, provider: Provider, answer: str, start_time: float,
+                        generation_start: float, enhanced_queries: List[str], all_results: List[SearchResult],
+                        ranked_results: List[RankedResult], sources: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Réponse finale, avec les métriques de recherche et de génération"""
+        end_time = time.perf_counter()
+        return {
+            "id": query_id,
+            "answer": answer,
+            "context_found": True,
+            "provider_used": provider.value,
+            "model_used": PROVIDER_CONFIGS[provider]["model"],
+            "response_time_ms": round((end_time - start_time) * 1000, 2),
+            "timestamp": datetime.now().isoformat(),
+            "search_results": len(all_results),
+            "ranked_results": len(ranked_results),
+            "enhanced_queries": enhanced_queries,
+            "sources": sources,
+            "performance_metrics": {
+                "search_time_ms": round((generation_start - start_time) * 1000, 2),
+                "generation_time_ms": round((end_time - generation_start) * 1000, 2),
+                "cache_hits": "metrics_available_via_prometheus"
+            }
+        }
 
     async def query(self, question: str, provider: Provider, top_k: int = 3, **kwargs) -> Dict[str, Any]:
         """Query ultra optimisé avec toutes les améliorations"""
-        start_time = time.time()
+        start_time = time.perf_counter()
         query_id = str(uuid.uuid4())
 
         try:
@@ -328,33 +332,8 @@ class UltraPerformantRAG:
                 return cached_response
 
             # 0. Vérification des réponses prédéfinies (priorité absolue)
-            predefined_response = None
-            if self.predefined_qa:
-                predefined_response = self.predefined_qa.get_predefined_answer(question)
-            
-            if predefined_response:
-                logger.info(f"Réponse prédéfinie trouvée pour: {question[:50]}...")
-                response = {
-                    "id": query_id,
-                    "answer": predefined_response["answer"],
-                    "context_found": True,
-                    "provider_used": "predefined_qa",
-                    "model_used": "template_based",
-                    "response_time_ms": round((time.time() - start_time) * 1000, 2),
-                    "timestamp": datetime.now().isoformat(),
-                    "search_results": 0,
-                    "ranked_results": 0,
-                    "enhanced_queries": [question],
-                    "sources": [{"type": "predefined", "content": "Base de connaissances CSS", "confidence": predefined_response["confidence"]}],
-                    "performance_metrics": {
-                        "search_time_ms": 0,
-                        "generation_time_ms": 0,
-                        "cache_hits": "predefined_response",
-                        "llm_calls_saved": True,
-                        "optimization_used": "predefined_qa",
-                        "matched_question": predefined_response["matched_question"]
-                    }
-                }
+            response = self._predefined_response(question, query_id, start_time)
+            if response:
                 # Mise en cache de la réponse prédéfinie
                 cache.set(cache_key, response, ttl=3600, cache_type="full_response")
                 return response
@@ -362,76 +341,18 @@ class UltraPerformantRAG:
             # 1. Provider LLM
             llm_provider = OptimizedLLMProvider(provider)
 
-            # 2. Enhancement de la requête
-            enhanced_queries = await self.query_enhancer.enhance_query(question, llm_provider)
-            logger.info(f"Requêtes générées: {enhanced_queries}")
-
-            # 3. Recherche hybride pour toutes les variantes
-            all_results = []
-            for query_variant in enhanced_queries:
-                variant_results = await self.hybrid_search.search(
-                    query_variant,
-                    n_results=15
-                )
-                all_results.extend(variant_results)
-
-            if not all_results:
-                no_context_response = {
-                    "id": query_id,
-                    "answer": "Je ne trouve pas d'informations spécifiques à votre question dans ma base de connaissances CSS. Pourriez-vous reformuler votre question ou être plus précis ?",
-                    "context_found": False,
-                    "provider_used": provider.value,
-                    "model_used": PROVIDER_CONFIGS[provider]["model"],
-                    "response_time_ms": round((time.time() - start_time) * 1000, 2),
-                    "timestamp": datetime.now().isoformat(),
-                    "search_results": 0,
-                    "ranked_results": 0,
-                    "enhanced_queries": enhanced_queries,
-                    "sources": [],
-                    "performance_metrics": {
-                        "search_time_ms": round((time.time() - start_time) * 1000, 2),
-                        "generation_time_ms": 0,
-                        "cache_hits": "no_context_found"
-                    }
-                }
-                return no_context_response
-
-            # 4. Re-ranking avec cross-encoder
-            ranked_results = self.reranker.rerank(question, all_results, top_k=top_k)
-
-            # 5. Préparation du contexte optimisé
-            context_parts = []
-            sources = []
-
-            for i, result in enumerate(ranked_results):
-                context_parts.append(f"Source {i + 1}: {result.content}")
-                sources.append({
-                    "source_id": i + 1,
-                    "score": float(result.score),
-                    "original_rank": result.original_rank,
-                    "metadata": result.metadata
-                })
-
-            context = "\n\n".join(context_parts)
-
-            # 6. Prompt optimisé avec instructions spécifiques
-            optimized_prompt = f"""Vous êtes un assistant expert de la Caisse de Sécurité Sociale du Sénégal.
-
-CONTEXTE:
-{context}
-
-QUESTION: {question}
-
-INSTRUCTIONS:
-1. Répondez de manière naturelle et professionnelle
-2. Utilisez uniquement les informations fournies dans le contexte
-3. Si les informations sont insuffisantes, proposez de reformuler la question
-4. Soyez précis et concis
-5. Synthétisez les informations de manière cohérente
+            # 2-4. Enhancement, recherche hybride et re-ranking
+            enhanced_queries, all_results, ranked_results = await self._retrieve_context(
+                question, llm_provider, top_k
+            )
+            if ranked_results is None:
+                return self._no_context_response(query_id, provider, enhanced_queries, start_time)
 
-RÉPONSE:"""
+            # 5-6. Contexte et prompt optimisé avec instructions spécifiques
+            sources, optimized_prompt = self._build_prompt(question, ranked_results)
 
             # 7. Génération de la réponse
+            generation_start = time.perf_counter()
             response_text = await llm_provider.generate_response(
                 optimized_prompt,
                 temperature=kwargs.get('temperature', 0.3),
@@ -439,27 +360,10 @@ RÉPONSE:"""
             )
 
             # 8. Construction de la réponse finale
-            end_time = time.time()
-            response_time_ms = round((end_time - start_time) * 1000, 2)
-
-            final_response = {
-                "id": query_id,
-                "answer": response_text,
-                "context_found": True,
-                "provider_used": provider.value,
-                "model_used": PROVIDER_CONFIGS[provider]["model"],
-                "response_time_ms": response_time_ms,
-                "timestamp": datetime.now().isoformat(),
-                "search_results": len(all_results),
-                "ranked_results": len(ranked_results),
-                "enhanced_queries": enhanced_queries,
-                "sources": sources,
-                "performance_metrics": {
-                    "search_time_ms": round((time.time() - start_time - (end_time - time.time())) * 1000, 2),
-                    "generation_time_ms": round((end_time - start_time) * 1000, 2),
-                    "cache_hits": "metrics_available_via_prometheus"
-                }
-            }
+            final_response = self._final_response(
+                query_id, provider, response_text, start_time, generation_start,
+                enhanced_queries, all_results, ranked_results, sources
+            )
 
             # 9. Cache de la réponse complète
             cache.set(cache_key, final_response, ttl=1800, cache_type="full_response")
@@ -468,46 +372,147 @@ RÉPONSE:"""
 
         except Exception as e:
             logger.error(f"Erreur query complète: {e}")
-            error_response = {
-                "id": query_id,
-                "answer": f"Erreur lors du traitement: {str(e)}",
-                "context_found": False,
-                "provider_used": provider.value,
-                "model_used": PROVIDER_CONFIGS.get(provider, {}).get("model", "unknown"),
-                "response_time_ms": round((time.time() - start_time) * 1000, 2),
-                "timestamp": datetime.now().isoformat(),
-                "search_results": 0,
-                "ranked_results": 0,
-                "enhanced_queries": [],
-                "sources": [],
-                "performance_metrics": {
-                    "search_time_ms": 0,
-                    "generation_time_ms": round((time.time() - start_time) * 1000, 2),
-                    "cache_hits": "error_occurred"
-                }
+            return self._error_response(query_id, provider, e, start_time)
+
+    async def query_stream(self, question: str, provider: Provider, top_k: int = 3,
+                           **kwargs) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Variante streaming de query : les tokens du LLM sont transmis dès leur génération.
+        Événements : {"type": "init"}, puis {"type": "chunk", "content"}, puis
+        {"type": "final", "response", "cache_hit", "source_previews"} (réponse complète identique
+        à celle de query, mise en cache à la fermeture du flux), ou {"type": "error", "error", "response"}.
+        """
+        start_time = time.perf_counter()
+        query_id = str(uuid.uuid4())
+
+        try:
+            cache_key = f"{question}_{provider.value}_{top_k}"
+            response = cache.get(cache_key, "full_response")
+            if not response:
+                response = self._predefined_response(question, query_id, start_time)
+                if response:
+                    cache.set(cache_key, response, ttl=3600, cache_type="full_response")
+            if response:
+                # Réponse déjà disponible : un seul fragment
+                yield {"type": "init", "id": response["id"], "enhanced_queries": response["enhanced_queries"]}
+                yield {"type": "chunk", "content": response["answer"]}
+                yield {"type": "final", "response": response, "cache_hit": True, "source_previews": []}
+                return
+
+            llm_provider = OptimizedLLMProvider(provider)
+            enhanced_queries, all_results, ranked_results = await self._retrieve_context(
+                question, llm_provider, top_k
+            )
+            yield {"type": "init", "id": query_id, "enhanced_queries": enhanced_queries}
+
+            if ranked_results is None:
+                response = self._no_context_response(query_id, provider, enhanced_queries, start_time)
+                yield {"type": "chunk", "content": response["answer"]}
+                yield {"type": "final", "response": response, "cache_hit": False, "source_previews": []}
+                return
+
+            sources, optimized_prompt = self._build_prompt(question, ranked_results)
+
+            # Génération en streaming : premier token transmis sans attendre la fin de la réponse
+            generation_start = time.perf_counter()
+            answer_parts = []
+            async for chunk in llm_provider.generate_stream(
+                optimized_prompt,
+                temperature=kwargs.get('temperature', 0.3),
+                max_tokens=kwargs.get('max_tokens', 512)
+            ):
+                if chunk:
+                    answer_parts.append(chunk)
+                    yield {"type": "chunk", "content": chunk}
+
+            # Métriques et mise en cache une fois le flux terminé
+            final_response = self._final_response(
+                query_id, provider, "".join(answer_parts), start_time, generation_start,
+                enhanced_queries, all_results, ranked_results, sources
+            )
+            cache.set(cache_key, final_response, ttl=1800, cache_type="full_response")
+            yield {
+                "type": "final",
+                "response": final_response,
+                "cache_hit": False,
+                "source_previews": [result.content[:100] + "..." for result in ranked_results]
             }
-            return error_response
 
-    def _ensure_multimodal_components(self):
-        """Initialise les composants multimodaux si nécessaire"""
-        if self.multimodal_embeddings is None:
-            logger.info("Initialisation des composants multimodaux...")
-            self.multimodal_embeddings = MultimodalEmbeddings()
-            self.multimodal_processor = MultimodalProcessor(self.multimodal_embeddings)
-            logger.info("Composants multimodaux initialisés")
+        except Exception as e:
+            logger.error(f"Erreur query streaming: {e}")
+            yield {"type": "error", "error": str(e), "response": self._error_response(query_id, provider, e, start_time)}
+
+    async def _ensure_multimodal_components(self):
+        """Initialise les composants multimodaux si nécessaire (chargement hors boucle d'événements)"""
+        if self.multimodal_processor is not None:
+            return
+        async with self._mm_lock:
+            if self.multimodal_processor is None:
+                logger.info("Initialisation des composants multimodaux...")
+                self.multimodal_embeddings = await asyncio.to_thread(MultimodalEmbeddings)
+                self.multimodal_processor = await asyncio.to_thread(MultimodalProcessor, self.multimodal_embeddings)
+                logger.info("Composants multimodaux initialisés")
 
     async def add_multimodal_document(self, file_content: bytes, filename: str, 
                                extract_text: bool = True, generate_captions: bool = True) -> Dict[str, Any]:
         """Ajoute un document multimodal au système RAG"""
-        self._ensure_multimodal_components()
-        return await self.multimodal_processor.process_multimodal_document(
+        await self._ensure_multimodal_components()
+        processed_data = await self.multimodal_processor.process_multimodal_document(
             file_content, filename, extract_text, generate_captions
         )
+        # Identifiant stable du contenu (déterministe entre redémarrages, contrairement à hash())
+        digest = hashlib.blake2b(file_content, digest_size=6).hexdigest()
+        document_id = f"multimodal_{filename}_{digest}"
+        chunks = self.multimodal_processor.create_multimodal_chunks(processed_data, document_id)
+
+        # Format attendu par ChromaDB et l'index BM25 : chunk_id en métadonnée,
+        # valeurs scalaires uniquement (taille d'image aplatie en chaîne)
+        chunks_data = [
+            {
+                "content": chunk["content"],
+                "metadata": {
+                    **{key: value if isinstance(value, (str, int, float, bool)) else str(value)
+                       for key, value in chunk["metadata"].items() if value is not None},
+                    "chunk_id": chunk["id"]
+                }
+            }
+            for chunk in chunks
+        ]
+
+        # Suppression des anciens chunks du même document (nouvel envoi du même fichier)
+        removed_ids = []
+        try:
+            removed_ids = (await asyncio.to_thread(
+                self.collection.get, where={"document_id": document_id}, include=[]
+            ))["ids"]
+            if removed_ids:
+                await asyncio.to_thread(self.collection.delete, ids=removed_ids)
+        except Exception:
+            pass
+
+        # Insertion par lots de 500 : une transaction ChromaDB par lot et non par chunk
+        documents = [chunk["content"] for chunk in chunks_data]
+        metadatas = [chunk["metadata"] for chunk in chunks_data]
+        ids = [metadata["chunk_id"] for metadata in metadatas]
+        batch_size = 500
+        for i in range(0, len(documents), batch_size):
+            await asyncio.to_thread(
+                self.collection.add,
+                documents=documents[i:i + batch_size],
+                metadatas=metadatas[i:i + batch_size],
+                ids=ids[i:i + batch_size]
+            )
+
+        # Mise à jour incrémentale de l'index BM25
+        if chunks_data or removed_ids:
+            await asyncio.to_thread(self.hybrid_search.add_to_index, chunks_data, removed_ids)
+
+        return {**processed_data.to_dict(), "document_id": document_id, "chunks_added": len(chunks_data)}
 
     async def multimodal_query(self, query: str, modality: str = "text", 
                         provider: Provider = Provider.MISTRAL, **kwargs) -> Dict[str, Any]:
         """Effectue une requête multimodale"""
-        self._ensure_multimodal_components()
+        await self._ensure_multimodal_components()
         # Pour l'instant, on utilise la requête standard
         return await self.query(query, provider, **kwargs)
 
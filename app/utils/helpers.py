@@ -7,5 +7,7 @@ def image_to_base64(image: Image.Image, format: str = "PNG") -> str:
     """Convertit une image PIL en string base64"""
     buffer = BytesIO()
     image.save(buffer, format=format)
-    img_str = base64.b64encode(buffer.getvalue()).decode()
+    # Encodage direct depuis le tampon (memoryview), sans copie via getvalue()
+    with buffer.getbuffer() as view:
+        img_str = base64.b64encode(view).decode('ascii')
     return f"data:image/{format.lower()};base64,{img_str}"
@@ -7,73 +7,34 @@ Debug du problème Unicode dans les réponses Telegram
 import json
 import re
 
+# Séquences d'échappement littérales (\uXXXX, \n, \t, \r, \", \') décodées en une seule passe
+_ESCAPE_RE = re.compile(r'\\(u[0-9a-fA-F]{4}|[ntr"\'])')
+_SIMPLE_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '"': '"', "'": "'"}
+
+
+def _unescape(match) -> str:
+    """Remplace une séquence d'échappement par le caractère correspondant"""
+    sequence = match.group(1)
+    if len(sequence) == 5:
+        return chr(int(sequence[1:], 16))
+    return _SIMPLE_ESCAPES[sequence]
+
+
 def fix_unicode_encoding_new(text: str) -> str:
     """Version corrigée de la méthode fix_unicode_encoding"""
     if not text or not isinstance(text, str):
         return text
         
+    # Méthode 1: Utiliser json.loads pour décoder les séquences Unicode
+    # Entourer le texte de guillemets pour en faire un JSON valide
+    json_text = '"' + text.replace('"', '\\"') + '"'
     try:
-        # Méthode 1: Utiliser json.loads pour décoder les séquences Unicode
-        # Entourer le texte de guillemets pour en faire un JSON valide
-        json_text = '"' + text.replace('"', '\\"') + '"'
-        try:
-            decoded_text = json.loads(json_text)
-            return decoded_text
-        except json.JSONDecodeError:
-            pass
-        
-        # Méthode 2: Utiliser une expression régulière pour remplacer les séquences \uXXXX
-        def unicode_replacer(match):
-            hex_code = match.group(1)
-            try:
-                return chr(int(hex_code, 16))
-            except ValueError:
-                return match.group(0)  # Retourner la séquence originale si erreur
-        
-        # Remplacer toutes les séquences \uXXXX
-        text = re.sub(r'\\u([0-9a-fA-F]{4})', unicode_replacer, text)
-        
-        # Décoder les séquences d'échappement courantes
-        text = text.replace('\\n', '\n')
-        text = text.replace('\\t', '\t')
-        text = text.replace('\\r', '\r')
-        text = text.replace('\\"', '"')
-        text = text.replace("\\\'", "'")
-            
-    except Exception as e:
-        print(f"Erreur de décodage Unicode: {e}")
-        # En cas d'erreur, essayer une approche alternative
-        try:
-            # Approche alternative : remplacer manuellement les séquences courantes
-            replacements = {
-                '\\u00e0': 'à', '\\u00e1': 'á', '\\u00e2': 'â', '\\u00e3': 'ã',
-                '\\u00e4': 'ä', '\\u00e5': 'å', '\\u00e6': 'æ', '\\u00e7': 'ç',
-                '\\u00e8': 'è', '\\u00e9': 'é', '\\u00ea': 'ê', '\\u00eb': 'ë',
-                '\\u00ec': 'ì', '\\u00ed': 'í', '\\u00ee': 'î', '\\u00ef': 'ï',
-                '\\u00f0': 'ð', '\\u00f1': 'ñ', '\\u00f2': 'ò', '\\u00f3': 'ó',
-                '\\u00f4': 'ô', '\\u00f5': 'õ', '\\u00f6': 'ö', '\\u00f8': 'ø',
-                '\\u00f9': 'ù', '\\u00fa': 'ú', '\\u00fb': 'û', '\\u00fc': 'ü',
-                '\\u00fd': 'ý', '\\u00ff': 'ÿ',
-                # Majuscules
-                '\\u00c0': 'À', '\\u00c1': 'Á', '\\u00c2': 'Â', '\\u00c3': 'Ã',
-                '\\u00c4': 'Ä', '\\u00c5': 'Å', '\\u00c6': 'Æ', '\\u00c7': 'Ç',
-                '\\u00c8': 'È', '\\u00c9': 'É', '\\u00ca': 'Ê', '\\u00cb': 'Ë',
-                '\\u00cc': 'Ì', '\\u00cd': 'Í', '\\u00ce': 'Î', '\\u00cf': 'Ï',
-                '\\u00d1': 'Ñ', '\\u00d2': 'Ò', '\\u00d3': 'Ó', '\\u00d4': 'Ô',
-                '\\u00d5': 'Õ', '\\u00d6': 'Ö', '\\u00d8': 'Ø', '\\u00d9': 'Ù',
-                '\\u00da': 'Ú', '\\u00db': 'Û', '\\u00dc': 'Ü', '\\u00dd': 'Ý',
-            }
-            
-            for escaped, char in replacements.items():
-                text = text.replace(escaped, char)
-                
-            # Nettoyer les séquences d'échappement restantes
-            text = text.replace('\\n', '\n').replace('\\t', '\t').replace('\\r', '\r')
-            
-        except Exception as e2:
-            print(f"Échec de l'approche alternative pour l'Unicode: {e2}")
+        return json.loads(json_text)
+    except json.JSONDecodeError:
+        pass
     
-    return text
+    # Méthode 2: Une seule expression régulière précompilée pour toutes les séquences
+    return _ESCAPE_RE.sub(_unescape, text)
 
 def test_user_example():
     """Test avec l'exemple exact de l'utilisateur"""
@@ -91,7 +52,8 @@ def test_user_example():
     print(corrected_text)
     
     print("\n=== VÉRIFICATION ===")
-    print(f"Contient encore \\u: {'\\u' in corrected_text}")
+    still_escaped = '\\u' in corrected_text
+    print(f"Contient encore \\u: {still_escaped}")
     
     # Test avec juste la partie problématique
     print("\n=== TEST PARTIE PROBLÉMATIQUE ===")
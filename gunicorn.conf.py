@@ -0,0 +1,16 @@
+# Configuration Gunicorn (production) : workers Uvicorn forkés depuis un maître
+# qui a déjà chargé le cross-encoder, pour partager ses poids en copie sur écriture.
+# Seul le cross-encoder est partagé : chaque worker charge sa propre copie de l'index
+# BM25 (fichier persisté) et de ChromaDB, la mémoire correspondante croît avec `workers`
+import os
+
+bind = "0.0.0.0:8000"
+workers = int(os.getenv("MAX_WORKERS", 4))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 120
+
+
+def on_starting(server):
+    """Pré-chargement des modèles dans le processus maître, avant le fork des workers"""
+    from app.core.reranker import preload_model
+    preload_model()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Export du cross-encoder de re-ranking en ONNX quantifié int8
+Usage: python scripts/export_reranker_onnx.py [dossier_sortie]
+Nécessite: pip install optimum[onnxruntime]
+"""
+
+import sys
+import tempfile
+
+from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer
+
+MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-12-v2"
+
+
+def main():
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else "./models/reranker-onnx-int8"
+
+    with tempfile.TemporaryDirectory() as export_dir:
+        # Export ONNX FP32
+        print(f"📦 Export ONNX de {MODEL_NAME}...")
+        model = ORTModelForSequenceClassification.from_pretrained(MODEL_NAME, export=True)
+        model.save_pretrained(export_dir)
+
+        # Quantification dynamique int8 (VNNI sur les CPU qui le supportent)
+        print("⚙️ Quantification int8...")
+        quantizer = ORTQuantizer.from_pretrained(export_dir)
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=output_dir, quantization_config=qconfig)
+
+    AutoTokenizer.from_pretrained(MODEL_NAME).save_pretrained(output_dir)
+    print(f"✅ Cross-encoder int8 disponible dans {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -50,21 +50,23 @@ DEBUG_MODE = os.getenv('DEBUG_MODE', 'false').lower() == 'true'
 MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', '20971520'))  # 20MB
 CACHE_TTL = int(os.getenv('CACHE_TTL', '3600'))  # 1 heure
 
-# Configuration du logging avec gestion robuste des erreurs
-try:
-    # Configuration du logging avec handlers personnalisés pour éviter les erreurs de buffer
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=logging.DEBUG if DEBUG_MODE else logging.INFO,
-        handlers=[
-            logging.StreamHandler(),  # Handler par défaut
-        ],
-        force=True  # Force la reconfiguration si déjà configuré
-    )
-except Exception as e:
-    # Fallback en cas d'erreur de configuration du logging
-    print(f"⚠️ Erreur de configuration du logging: {e}")
-    logging.basicConfig(level=logging.INFO)
+def configure_logging():
+    """Configuration du logging avec gestion robuste des erreurs (exécution autonome uniquement,
+    pour ne pas écraser la configuration de l'API quand le bot tourne dans son processus)"""
+    try:
+        # Configuration du logging avec handlers personnalisés pour éviter les erreurs de buffer
+        logging.basicConfig(
+            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            level=logging.DEBUG if DEBUG_MODE else logging.INFO,
+            handlers=[
+                logging.StreamHandler(),  # Handler par défaut
+            ],
+            force=True  # Force la reconfiguration si déjà configuré
+        )
+    except Exception as e:
+        # Fallback en cas d'erreur de configuration du logging
+        print(f"⚠️ Erreur de configuration du logging: {e}")
+        logging.basicConfig(level=logging.INFO)
 
 logger = logging.getLogger(__name__)
 
@@ -2368,12 +2370,12 @@ Envoyez une image puis posez votre question.
             except Exception:
                 pass
     
-    async def run_async(self):
+    async def run_async(self, token: Optional[str] = None):
         """Démarre le bot de manière asynchrone"""
         logger.info("🚀 Démarrage du bot Telegram CSS avancé...")
         
         # Création de l'application
-        application = Application.builder().token(TELEGRAM_TOKEN).build()
+        application = Application.builder().token(token or TELEGRAM_TOKEN).build()
         
         # Initialisation de l'application
         await application.initialize()
@@ -2398,8 +2400,11 @@ Envoyez une image puis posez votre question.
             logger.error(f"Erreur lors du démarrage: {e}")
             raise
         finally:
-            # Nettoyage
-            await application.stop()
+            # Nettoyage (le polling doit être arrêté avant l'application)
+            if application.updater and application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
             await application.shutdown()
     
     def run(self):
@@ -2412,8 +2417,17 @@ Envoyez une image puis posez votre question.
             logger.error(f"Erreur fatale dans run(): {e}")
             raise
 
+async def run_bot(token: Optional[str] = None, api_url: Optional[str] = None):
+    """Exécute le bot dans la boucle asyncio courante (tâche de l'API FastAPI)"""
+    bot = TelegramCSSBotAdvanced()
+    if api_url:
+        bot.css_api_url = api_url
+    await bot.run_async(token)
+
 def main():
     """Point d'entrée principal"""
+    configure_logging()
+
     # Configuration de l'encodage pour éviter les erreurs Unicode
     import sys
     if sys.platform == "win32":
@@ -1,5 +1,6 @@
 ﻿from pathlib import Path
 from PIL import Image
+import asyncio
 import io
 import sys
 
@@ -26,14 +27,14 @@ try:
     
     # Tester la fonction process_image_document
     print(f'Tentative de traitement avec process_image_document...')
-    result = multimodal_processor.process_image_document(
+    result = asyncio.run(multimodal_processor.process_image_document(
         image_content, 
         'valid_image.jpg', 
         extract_text=False, 
         generate_captions=False
-    )
+    ))
     print(f'Traitement réussi!')
-    print(f'Métadonnées: {result["metadata"]}')
+    print(f'Métadonnées: {result.metadata}')
     
 except Exception as e:
     print(f'Erreur: {e}')
@@ -1,4 +1,5 @@
-﻿import os
+﻿import asyncio
+import os
 import sys
 from PIL import Image
 from app.core.multimodal_processor import MultimodalProcessor
@@ -23,12 +24,11 @@ try:
     with Image.open(image_path) as img:
         print(f"Image ouverte avec succès: {img.format}, {img.size}, {img.mode}")
         # Tester la fonction process_image_document
-        result = processor.process_image_document(image_path)
+        result = asyncio.run(processor.process_image_document(image_path))
         print("\nRésultat du traitement:")
-        print(f"Métadonnées: {result.get('metadata', {})}")
-        print(f"Texte OCR: {result.get('text', '')}")
-        print(f"Description: {result.get('description', '')}")
-        print(f"Modalités: {result.get('modalities', [])}")
+        print(f"Métadonnées: {result.metadata}")
+        print(f"Texte OCR: {result.ocr_text}")
+        print(f"Description: {result.caption}")
         print("\nTraitement réussi!")
 except Exception as e:
     print(f"Erreur lors du traitement de l'image: {e}")